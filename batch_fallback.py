@@ -0,0 +1,200 @@
+import re
+import zlib
+
+import Levenshtein
+import numpy as np
+
+from extract import clean_log_text
+
+
+def mask_template(log_text):
+    """将数字替换为占位符，得到用于分组的日志模板"""
+    return re.sub(r"\d+", "<*>", log_text)
+
+
+def ngram_vectors(texts, n=3, dim=1024):
+    """字符 n-gram 哈希向量（按行 L2 归一化）"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        padded = f" {text} "
+        # 使用稳定的 crc32，保证不同进程得到相同的分桶
+        grams = [zlib.crc32(padded[i:i + n].encode("utf-8")) % dim for i in range(max(len(padded) - n + 1, 1))]
+        matrix[row] = np.bincount(grams, minlength=dim)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def char_histograms(texts, dim=256):
+    """字符计数向量，用于计算编辑距离的下界"""
+    matrix = np.zeros((len(texts), dim), dtype=np.int32)
+    for row, text in enumerate(texts):
+        if text:
+            matrix[row] = np.bincount([ord(c) % dim for c in text], minlength=dim)
+    return matrix
+
+
+class BatchFallback:
+    """延迟执行的相似度回退：收集未匹配日志，按模板去重后批量计算相似度，再把选中的规则应用到组内每条日志"""
+
+    def __init__(self, rules, empty_on_miss=True, min_similarity=None, use_priority=True, shortlist=16, ngram=3, dim=1024,
+                 block_size=256):
+        # empty_on_miss: 最相似规则未匹配时返回空值字段（extract.py 的行为），否则返回未匹配原因（extract1.py 的行为）
+        # use_priority: 相似度相同时先比较 priority 再取靠前的规则（extract.py），否则直接取靠前的规则（extract1.py）
+        self.empty_on_miss = empty_on_miss
+        self.min_similarity = min_similarity
+        self.shortlist = shortlist
+        self.ngram = ngram
+        self.dim = dim
+        self.block_size = block_size
+        self.groups = {}
+
+        # 与逐条回退相同：将 \- 替换为 _ 后重新编译
+        self.rules = []
+        for rule in rules:
+            try:
+                compiled = re.compile(re.sub(r"\\-", "_", rule["pattern"]))
+            except (re.error, KeyError):
+                continue
+            self.rules.append((rule, compiled))
+
+        # 所有规则的示例去重后组成示例矩阵，记录每个示例所属的规则
+        example_index = {}
+        self.example_rules = []
+        for rule_id, (rule, _) in enumerate(self.rules):
+            for example in rule.get("examples", []):
+                if example not in example_index:
+                    example_index[example] = len(self.example_rules)
+                    self.example_rules.append([])
+                self.example_rules[example_index[example]].append(rule_id)
+        self.examples = list(example_index)
+        self.example_matrix = ngram_vectors(self.examples, ngram, dim) if self.examples else None
+
+        # 规则与示例的对应关系展开为数组，用于批量计算每条规则相似度的上界
+        self.example_hists = char_histograms(self.examples)
+        pair_rules, pair_examples = [], []
+        for example_id, rule_ids in enumerate(self.example_rules):
+            for rule_id in rule_ids:
+                pair_rules.append(rule_id)
+                pair_examples.append(example_id)
+        self.pair_rules = np.array(pair_rules, dtype=np.intp)
+        self.pair_examples = np.array(pair_examples, dtype=np.intp)
+        self.rule_max_len = np.zeros(len(self.rules))
+        np.maximum.at(self.rule_max_len, self.pair_rules, [len(self.examples[i]) for i in pair_examples])
+        # 精确计算时使用的 (示例列表, 最长示例长度, priority)
+        self.rule_scoring = []
+        for rule, _ in self.rules:
+            examples = rule.get("examples", [])
+            priority = rule.get("priority", 0) if use_priority else 0
+            self.rule_scoring.append((examples, max((len(e) for e in examples), default=1), priority))
+
+    def add(self, key, log_text):
+        """登记一条原始规则未匹配的日志，key 用于在 resolve 结果中取回该日志的字段"""
+        log_text_clean = clean_log_text(log_text, use_extra_clean=True)
+        self.groups.setdefault(mask_template(log_text_clean), []).append((key, log_text_clean))
+
+    def resolve(self, with_rules=False):
+        """批量完成回退，返回 {key: (fields, reason)}；with_rules=True 时返回 {key: (fields, reason, rule)}，未匹配时 rule 为 None"""
+        results = {}
+        templates = list(self.groups)
+        if not self.rules:
+            for template in templates:
+                for key, _ in self.groups[template]:
+                    results[key] = ([], "所有规则均无效", None) if with_rules else ([], "所有规则均无效")
+            return results
+
+        for start in range(0, len(templates), self.block_size):
+            block = templates[start:start + self.block_size]
+            candidates = self._shortlist([self.groups[t][0][1] for t in block])
+            for template, rule_ids in zip(block, candidates):
+                members = self.groups[template]
+                rule = self._select_rule(members[0][1], rule_ids)
+                for key, log_text_clean in members:
+                    fields, reason = self._apply(rule, log_text_clean)
+                    if with_rules:
+                        results[key] = (fields, reason, rule[0] if rule and not reason else None)
+                    else:
+                        results[key] = (fields, reason)
+        self.groups = {}
+        return results
+
+    def _shortlist(self, texts):
+        """用 n-gram 向量的余弦相似度为每个代表日志挑选候选规则"""
+        if self.example_matrix is None:
+            return [[] for _ in texts]
+        scores = ngram_vectors(texts, self.ngram, self.dim) @ self.example_matrix.T
+        k = min(self.shortlist, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        shortlists = []
+        for row in top:
+            rule_ids = []
+            for example_id in row:
+                for rule_id in self.example_rules[example_id]:
+                    if rule_id not in rule_ids:
+                        rule_ids.append(rule_id)
+            shortlists.append(rule_ids)
+        return shortlists
+
+    def _select_rule(self, log_text_clean, rule_ids):
+        """按原有公式计算精确的编辑距离相似度，取最相似（同分按 use_priority 取 priority 高的，再同分取靠前）的规则。
+
+        先计算候选规则，再按相似度上界从高到低检查其余规则，上界低于当前最优时停止，结果与逐条比较全部规则一致。
+        所有规则都没有示例时，与逐条回退一样相似度均视为 -inf，只按同分规则选择。
+        """
+        distance = Levenshtein.distance
+        text_len = len(log_text_clean)
+        best_id, best_key = None, None
+        checked = set()
+
+        def score(rule_id):
+            examples, max_example_len, priority = self.rule_scoring[rule_id]
+            min_dist = min(distance(log_text_clean, e) for e in examples)
+            return 1 - (min_dist / max(text_len, max_example_len)), priority, -rule_id
+
+        for rule_id in rule_ids:
+            checked.add(rule_id)
+            key = score(rule_id)
+            if best_key is None or key > best_key:
+                best_id, best_key = rule_id, key
+        bounds = self._upper_bounds(log_text_clean)
+        for rule_id in np.argsort(-bounds, kind="stable").tolist():
+            bound = bounds[rule_id]
+            if bound == float("-inf") or (best_key is not None and bound < best_key[0]):
+                break
+            if rule_id not in checked:
+                key = score(rule_id)
+                if best_key is None or key > best_key:
+                    best_id, best_key = rule_id, key
+        if best_id is None:
+            best_id = max(range(len(self.rules)), key=lambda r: (self.rule_scoring[r][2], -r))
+            best_key = (float("-inf"),)
+        if self.min_similarity is not None and best_key[0] <= self.min_similarity:
+            return None
+        return self.rules[best_id]
+
+    def _upper_bounds(self, log_text_clean):
+        """每条规则相似度的上界：字符计数差（bag distance）不超过编辑距离"""
+        bounds = np.full(len(self.rules), float("-inf"))
+        if not len(self.pair_rules):
+            return bounds
+        diff = self.example_hists - char_histograms([log_text_clean])[0]
+        bag = np.maximum(np.maximum(diff, 0).sum(axis=1), np.maximum(-diff, 0).sum(axis=1))
+        min_bag = np.full(len(self.rules), np.inf)
+        np.minimum.at(min_bag, self.pair_rules, bag[self.pair_examples])
+        has_examples = np.isfinite(min_bag)
+        max_len = np.maximum(len(log_text_clean), np.maximum(self.rule_max_len, 1))
+        bounds[has_examples] = 1 - min_bag[has_examples] / max_len[has_examples]
+        return bounds
+
+    def _apply(self, selected, log_text_clean):
+        if selected is None:
+            return [], "没有找到匹配规则"
+        rule, compiled = selected
+        m = compiled.search(log_text_clean)
+        if m:
+            group_dict = m.groupdict()
+        elif self.empty_on_miss:
+            group_dict = {fn: "" for fn in compiled.groupindex}
+        else:
+            return [], "没有找到匹配规则"
+        return [{"name": k, "value": v.strip() if v else ""} for k, v in group_dict.items()], None
@@ -0,0 +1,139 @@
+import json
+import os
+import random
+import tempfile
+import time
+import argparse
+
+from mock_llm import MockLLMServer, load_recordings
+
+
+# 合成标注数据使用的日志模板：(模板, 字段名列表)
+SYNTHETIC_TEMPLATES = [
+    ("<190>{time} {host} %%01SHELL/5/CMDRECORD(s)[{seq}]:Recorded command information. "
+     "(Task=VT{task}, Ip={ip}, User={user}, Command=\"{cmd}\", Result={result})",
+     ["time", "host", "ip", "user", "cmd", "result"]),
+    ("<187>{time} {host} %%01SSH/4/LOGIN_FAIL(l)[{seq}]:User login failed. (UserName={user}, IpAddress={ip}, "
+     "VpnName=, Reason={reason})",
+     ["time", "host", "user", "ip", "reason"]),
+    ("<134>{time} {host} sshd[{seq}]: Accepted password for {user} from {ip} port {port} ssh2",
+     ["time", "host", "user", "ip", "port"]),
+]
+
+
+def synthetic_records(count, seed=None):
+    """生成带标注的模拟日志"""
+    rng = random.Random(seed)
+    records = []
+    for _ in range(count):
+        template, names = rng.choice(SYNTHETIC_TEMPLATES)
+        values = {
+            "time": f"Jan {rng.randint(1, 28)} 2025 {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+            "host": f"ZX_HXJF_D_S{rng.randint(1000, 9999)}-0{rng.randint(1, 9)}",
+            "seq": rng.randint(1, 99999),
+            "task": rng.randint(0, 9),
+            "ip": ".".join(str(rng.randint(1, 254)) for _ in range(4)),
+            "user": rng.choice(["admin", "root", "operator", "guest"]),
+            "cmd": rng.choice(["display current", "save", "undo shutdown", "reset counters"]),
+            "result": rng.choice(["Success", "Failed"]),
+            "reason": rng.choice(["AuthFailed", "Timeout"]),
+            "port": rng.randint(1024, 65535),
+        }
+        records.append({
+            "logText": template.format(**values),
+            "logField": [{"name": name, "value": str(values[name])} for name in names],
+        })
+    return records
+
+
+def benchmark(target, labeled_data_file, server, rules_file, model_name="mock-model", use_synthesizer=False):
+    """针对模拟服务运行一次生成流程，返回吞吐、调用次数和重试统计"""
+    with open(labeled_data_file, encoding="utf-8") as f:
+        logs = len(json.load(f))
+
+    # 重试次数取生成流程自身的统计，模拟服务只能看到重复的提示词
+    metrics_file = os.path.splitext(rules_file)[0] + ".prom"
+    server.reset_stats()
+    start = time.perf_counter()
+    if target == "generate1":
+        import generate1
+        generate1.generate(labeled_data_file, rules_file, "mock-api-key", model_name, server.url,
+                           use_synthesizer=use_synthesizer, metrics_file=metrics_file)
+    elif target == "generate2":
+        import generate2
+        generate2.LOCAL_BASE_URL = f"{server.url}/v1/"
+        generate2.generate(labeled_data_file, rules_file, model_name, use_synthesizer=use_synthesizer,
+                           metrics_file=metrics_file)
+    else:
+        raise ValueError(f"未知的生成入口：{target}")
+    elapsed = time.perf_counter() - start
+    with open(os.path.splitext(metrics_file)[0] + ".summary.json", encoding="utf-8") as f:
+        counters = json.load(f)["counters"]
+
+    with open(rules_file, encoding="utf-8") as f:
+        rules = len(json.load(f))
+    stats = server.stats()
+    return {
+        "target": target,
+        "logs": logs,
+        "rules": rules,
+        "wall_seconds": elapsed,
+        "logs_per_second": logs / elapsed if elapsed else 0.0,
+        "llm_calls": stats["requests"],
+        "llm_calls_per_rule": stats["requests"] / rules if rules else 0.0,
+        "retries": counters.get("llm_retries", 0),
+        "llm_errors": counters.get("llm_errors", 0),
+        "repeated_prompts": stats["repeated_prompts"],
+        "status": stats["status"],
+        "malformed": stats["malformed"],
+        "completion_tokens": stats["completion_tokens"],
+    }
+
+
+def print_result(result):
+    print(f"[{result['target']}] 日志 {result['logs']} 条，生成规则 {result['rules']} 条，"
+          f"耗时 {result['wall_seconds']:.2f} 秒，吞吐 {result['logs_per_second']:.2f} 条/秒")
+    print(f"  大模型调用 {result['llm_calls']} 次（每条规则 {result['llm_calls_per_rule']:.2f} 次），"
+          f"重试 {result['retries']} 次，失败 {result['llm_errors']} 次，状态码 {result['status']}，"
+          f"不完整 JSON {result['malformed']} 次")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--labeled_data_file", default=None, help="带标注的日志文件，不指定时生成模拟数据")
+    parser.add_argument("--synthetic_count", type=int, default=200, help="模拟数据条数")
+    parser.add_argument("--targets", default="generate1,generate2", help="要测试的生成入口，逗号分隔")
+    parser.add_argument("--latency", default="fixed:0.05", help="模拟服务的延迟分布")
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0)
+    parser.add_argument("--malformed_rate", type=float, default=0.0)
+    parser.add_argument("--record_file", default=None, help="录制的响应（JSON Lines），命中时直接回放")
+    parser.add_argument("--use_synthesizer", action="store_true", help="生成时启用本地规则合成（默认关闭，以测量大模型路径）")
+    parser.add_argument("--report_file", default=None, help="测试结果保存路径（可选）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_generate_")
+    labeled_data_file = args.labeled_data_file
+    if not labeled_data_file:
+        labeled_data_file = os.path.join(work_dir, "labeled.json")
+        with open(labeled_data_file, "w", encoding="utf-8") as f:
+            json.dump(synthetic_records(args.synthetic_count, args.seed), f, ensure_ascii=False)
+
+    recordings = load_recordings(args.record_file) if args.record_file else None
+    server = MockLLMServer(latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                           malformed_rate=args.malformed_rate, recordings=recordings, seed=args.seed).start()
+    results = []
+    try:
+        for target in args.targets.split(","):
+            rules_file = os.path.join(work_dir, f"rules_{target}.json")
+            result = benchmark(target.strip(), labeled_data_file, server, rules_file,
+                               use_synthesizer=args.use_synthesizer)
+            print_result(result)
+            results.append(result)
+    finally:
+        server.stop()
+
+    if args.report_file:
+        with open(args.report_file, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
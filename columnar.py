@@ -0,0 +1,178 @@
+import gzip
+import json
+import lzma
+import argparse
+
+
+FORMAT_NAME = "logparse-columnar"
+FORMAT_VERSION = 1
+COMPRESSIONS = ("none", "gzip", "lzma")
+
+
+def _open(path, mode, compression=None):
+    """按压缩方式打开文本文件；读取时根据文件头自动识别 gzip / xz"""
+    if "r" in mode:
+        with open(path, "rb") as f:
+            magic = f.read(6)
+        if magic[:2] == b"\x1f\x8b":
+            compression = "gzip"
+        elif magic == b"\xfd7zXZ\x00":
+            compression = "lzma"
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "lzma":
+        return lzma.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _dict_key(value):
+    # True、1、1.0 彼此相等且哈希相同，按类型区分；浮点数按 repr 区分 0.0 和 -0.0
+    return type(value), repr(value) if type(value) is float else value
+
+
+def encode_column(values, dict_ratio=0.5):
+    """不同取值占比不超过 dict_ratio 时使用字典编码（dictionary + codes），否则原样保存"""
+    index = {}
+    dictionary = []
+    codes = []
+    try:
+        for value in values:
+            key = _dict_key(value)
+            code = index.get(key)
+            if code is None:
+                code = index[key] = len(dictionary)
+                dictionary.append(value)
+            codes.append(code)
+    except TypeError:
+        # 取值不可哈希（如嵌套对象）时不做字典编码
+        return {"values": list(values)}
+    if len(values) > 1 and len(dictionary) <= dict_ratio * len(values):
+        return {"dictionary": dictionary, "codes": codes}
+    return {"values": list(values)}
+
+
+def decode_column(column):
+    if "codes" in column:
+        dictionary = column["dictionary"]
+        return [dictionary[code] for code in column["codes"]]
+    return column["values"]
+
+
+def _encode_block(rule_id, field_names, rows, records, dict_ratio):
+    # 行号递增，按差值保存便于压缩
+    deltas = [rows[0]] + [b - a for a, b in zip(rows, rows[1:])]
+    block = {"rule": rule_id, "count": len(rows), "index_delta": deltas, "columns": {}, "attributes": {}}
+    for position, name in enumerate(field_names):
+        block["columns"][name] = encode_column([records[i]["logField"][position]["value"] for i in rows], dict_ratio)
+
+    # 原始记录中除 logField 以外的键（logText 等）同样按列保存，缺少该键的行记录在 missing 中
+    keys = {}
+    for i in rows:
+        for key in records[i]:
+            if key != "logField":
+                keys.setdefault(key, None)
+    missing = {}
+    for key in keys:
+        values = []
+        for row, i in enumerate(rows):
+            if key in records[i]:
+                values.append(records[i][key])
+            else:
+                values.append(None)
+                missing.setdefault(key, []).append(row)
+        block["attributes"][key] = encode_column(values, dict_ratio)
+    if missing:
+        block["missing"] = missing
+    return block
+
+
+def write_columnar(output_file, records, record_rules, rules, compression=None, block_size=65536, dict_ratio=0.5):
+    """按匹配规则分组写出列式结果。
+
+    records 为解析结果（带 logField 的原始日志对象），record_rules 为每条记录选中的规则（未匹配为 None），
+    rules 为规则列表，块中以规则在列表中的下标标识规则。
+    """
+    rule_index = {id(rule): i for i, rule in enumerate(rules)}
+    groups = {}
+    for i, (record, rule) in enumerate(zip(records, record_rules)):
+        rule_id = rule_index.get(id(rule)) if rule is not None else None
+        field_names = tuple(field["name"] for field in record.get("logField", []))
+        groups.setdefault((rule_id, field_names), []).append(i)
+
+    blocks = 0
+    with _open(output_file, "w", None if compression == "none" else compression) as f:
+        header = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "records": len(records), "groups": len(groups)}
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for (rule_id, field_names), rows in groups.items():
+            for start in range(0, len(rows), block_size):
+                block = _encode_block(rule_id, field_names, rows[start:start + block_size], records, dict_ratio)
+                f.write(json.dumps(block, ensure_ascii=False, separators=(",", ":")) + "\n")
+                blocks += 1
+    return blocks
+
+
+def read_header(input_file):
+    with _open(input_file, "r") as f:
+        header = json.loads(f.readline())
+    if header.get("format") != FORMAT_NAME:
+        raise ValueError(f"不是列式结果文件：{input_file}")
+    return header
+
+
+def iter_blocks(input_file):
+    """逐块读取，产出 {"rule", "count", "index", "columns", "attributes"}，各列已解码为列表，适合按规则聚合"""
+    with _open(input_file, "r") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != FORMAT_NAME:
+            raise ValueError(f"不是列式结果文件：{input_file}")
+        for line in f:
+            if not line.strip():
+                continue
+            block = json.loads(line)
+            index = []
+            row = 0
+            for delta in block["index_delta"]:
+                row += delta
+                index.append(row)
+            attributes = {key: decode_column(column) for key, column in block["attributes"].items()}
+            yield {
+                "rule": block["rule"],
+                "count": block["count"],
+                "index": index,
+                "columns": {name: decode_column(column) for name, column in block["columns"].items()},
+                "attributes": attributes,
+                "missing": {key: set(rows) for key, rows in block.get("missing", {}).items()},
+            }
+
+
+def iter_records(input_file, ordered=False):
+    """还原为原始结果格式（带 logField 的日志对象）逐条产出；ordered=True 时按原始顺序（需要整体载入）"""
+    def records():
+        for block in iter_blocks(input_file):
+            names = list(block["columns"])
+            columns = [block["columns"][name] for name in names]
+            for row, index in enumerate(block["index"]):
+                record = {key: values[row] for key, values in block["attributes"].items()
+                          if row not in block["missing"].get(key, ())}
+                record["logField"] = [{"name": name, "value": values[row]} for name, values in zip(names, columns)]
+                yield index, record
+
+    if not ordered:
+        for _, record in records():
+            yield record
+        return
+    result = [None] * read_header(input_file)["records"]
+    for index, record in records():
+        result[index] = record
+    yield from result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_file", required=True, help="列式结果文件")
+    parser.add_argument("--output_file", required=True, help="还原后的 JSON 结果保存路径")
+    args = parser.parse_args()
+
+    with open(args.output_file, "w", encoding="utf-8") as f:
+        json.dump(list(iter_records(args.input_file, ordered=True)), f, ensure_ascii=False, indent=4)
+    print(f"已还原为 JSON：{args.output_file}")
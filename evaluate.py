@@ -0,0 +1,236 @@
+import json
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+from multiprocessing import Pool
+
+from extract import LogParser
+
+
+FALLBACK = -1  # 原始规则未匹配，由相似度回退给出结果
+NO_MATCH = -2  # 回退也未能给出结果
+
+# 子进程内的解析器，由 _init_worker 初始化
+_parser = None
+_rule_index = None
+
+
+def iter_records(file_path, buffer_size=1 << 20):
+    """流式读取标注数据，支持 JSON 数组和 JSON Lines，不一次性载入整个文件"""
+    decoder = json.JSONDecoder()
+    with open(file_path, encoding="utf-8") as f:
+        head = f.read(buffer_size)
+        if not head.lstrip().startswith("["):
+            # JSON Lines：每行一条记录
+            f.seek(0)
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        buffer = head.lstrip()
+        pos = 1
+        eof = False
+        while True:
+            # 跳过空白和逗号，缓冲区用尽时继续读取
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                chunk = f.read(buffer_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+            if pos >= len(buffer) or buffer[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # 当前元素被缓冲区截断，读入更多内容后重试
+                if eof:
+                    raise
+                chunk = f.read(buffer_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield record
+            pos = end
+
+
+def iter_batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append((record["logText"], record.get("logField", [])))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _init_worker(rules_file, compact=False):
+    global _parser, _rule_index
+    _parser = LogParser(rules_file, compact)
+    _rule_index = {id(rule): i for i, rule in enumerate(_parser.rules)}
+
+
+def _evaluate_batch(batch):
+    """在子进程中评估一批日志，返回可合并的计数结果"""
+    stats = {
+        "logs": 0,
+        "correct": 0,
+        "fallback": 0,
+        "no_match": 0,
+        "field_tp": Counter(),
+        "field_pred": Counter(),
+        "field_gold": Counter(),
+        "rule_hits": Counter(),
+        "rule_correct": Counter(),
+    }
+    for log_text, log_fields in batch:
+        rule, m = _parser.match(log_text)
+        if rule:
+            rule_id = _rule_index[id(rule)]
+            extracted = {k: (v.strip() if v else "") for k, v in m.groupdict().items()}
+        else:
+            fields, reason = _parser.fallback(log_text)
+            rule_id = NO_MATCH if reason else FALLBACK
+            extracted = {f["name"]: f["value"] for f in fields}
+
+        # 空值字段与提取结果一样不计入，否则这些字段永远无法成为 true positive
+        gold = {f["name"]: (f.get("value") or "").strip() for f in log_fields}
+        gold = {k: v for k, v in gold.items() if v}
+        predicted = {k: v for k, v in extracted.items() if v}
+        for name, value in predicted.items():
+            stats["field_pred"][name] += 1
+            if gold.get(name) == value:
+                stats["field_tp"][name] += 1
+        for name in gold:
+            stats["field_gold"][name] += 1
+
+        is_correct = predicted == gold
+        stats["logs"] += 1
+        stats["correct"] += is_correct
+        stats["fallback"] += rule_id == FALLBACK
+        stats["no_match"] += rule_id == NO_MATCH
+        stats["rule_hits"][rule_id] += 1
+        stats["rule_correct"][rule_id] += is_correct
+    return stats
+
+
+def _merge(total, stats):
+    for key, value in stats.items():
+        if isinstance(value, Counter):
+            total.setdefault(key, Counter()).update(value)
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def _ratio(a, b):
+    return a / b if b else 0.0
+
+
+def evaluate(labeled_data_file, rules_file, processes=None, batch_size=500, top_n=10, compact=False):
+    """多进程评估规则文件在标注数据上的准确率，返回评估报告"""
+    with open(rules_file, encoding="utf-8") as f:
+        patterns = [rule.get("pattern", "") for rule in json.load(f)]
+
+    processes = processes or os.cpu_count() or 1
+    # 限制在途批次数，避免提前读入全部数据
+    max_pending = processes * 4
+    total = {}
+    start = time.perf_counter()
+
+    with Pool(processes, initializer=_init_worker, initargs=(rules_file, compact)) as pool:
+        pending = []
+        for batch in iter_batches(iter_records(labeled_data_file), batch_size):
+            pending.append(pool.apply_async(_evaluate_batch, (batch,)))
+            if len(pending) >= max_pending:
+                _merge(total, pending.pop(0).get())
+        for result in pending:
+            _merge(total, result.get())
+
+    elapsed = time.perf_counter() - start
+    logs = total.get("logs", 0)
+    field_tp = total.get("field_tp", Counter())
+    field_pred = total.get("field_pred", Counter())
+    field_gold = total.get("field_gold", Counter())
+    rule_hits = total.get("rule_hits", Counter())
+    rule_correct = total.get("rule_correct", Counter())
+
+    fields = {}
+    for name in sorted(set(field_pred) | set(field_gold)):
+        fields[name] = {
+            "precision": _ratio(field_tp[name], field_pred[name]),
+            "recall": _ratio(field_tp[name], field_gold[name]),
+            "support": field_gold[name],
+        }
+
+    rules = []
+    for rule_id, hits in rule_hits.items():
+        if rule_id == FALLBACK:
+            pattern = "<fallback>"
+        elif rule_id == NO_MATCH:
+            pattern = "<no_match>"
+        else:
+            pattern = patterns[rule_id]
+        rules.append({
+            "rule": rule_id,
+            "pattern": pattern,
+            "hits": hits,
+            "correct": rule_correct[rule_id],
+            "errors": hits - rule_correct[rule_id],
+            "accuracy": _ratio(rule_correct[rule_id], hits),
+        })
+    rules.sort(key=lambda r: (-r["errors"], -r["hits"]))
+
+    return {
+        "logs": logs,
+        "accuracy": _ratio(total.get("correct", 0), logs),
+        "fallback_rate": _ratio(total.get("fallback", 0), logs),
+        "no_match_rate": _ratio(total.get("no_match", 0), logs),
+        "elapsed_seconds": elapsed,
+        "logs_per_second": _ratio(logs, elapsed),
+        "fields": fields,
+        "rules": rules,
+        "worst_rules": [r for r in rules if r["errors"] > 0][:top_n],
+    }
+
+
+def print_report(report):
+    print(f"日志总数：{report['logs']}，整体准确率：{report['accuracy']:.4f}")
+    print(f"回退命中率：{report['fallback_rate']:.4f}，未匹配率：{report['no_match_rate']:.4f}")
+    print(f"耗时：{report['elapsed_seconds']:.2f} 秒，吞吐：{report['logs_per_second']:.1f} 条/秒")
+    print("\n各字段准确率：")
+    for name, m in report["fields"].items():
+        print(f"  {name}: precision={m['precision']:.4f} recall={m['recall']:.4f} support={m['support']}")
+    if report["worst_rules"]:
+        print("\n错误最多的规则：")
+        for r in report["worst_rules"]:
+            print(f"  规则 {r['rule']} 错误 {r['errors']}/{r['hits']}（正则: {r['pattern']}）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--labeled_data_file", required=True, help="带标注的日志文件（JSON 数组或 JSON Lines）")
+    parser.add_argument("--rules_file", required=True, help="待评估的规则文件")
+    parser.add_argument("--report_file", default=None, help="评估报告保存路径（可选）")
+    parser.add_argument("--processes", type=int, default=None, help="进程数，默认使用全部 CPU 核心")
+    parser.add_argument("--batch_size", type=int, default=500)
+    parser.add_argument("--top_n", type=int, default=10, help="列出错误最多的规则数量")
+    parser.add_argument("--compact_rules", action="store_true", help="子进程使用紧凑的规则存储，降低内存占用")
+    parser.add_argument("--min_accuracy", type=float, default=None, help="整体准确率低于该值时以非零状态退出，用于规则上线前的检查")
+    args = parser.parse_args()
+
+    report = evaluate(args.labeled_data_file, args.rules_file, args.processes, args.batch_size, args.top_n,
+                      args.compact_rules)
+    print_report(report)
+    if args.report_file:
+        with open(args.report_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.min_accuracy is not None and report["accuracy"] < args.min_accuracy:
+        print(f"整体准确率 {report['accuracy']:.4f} 低于阈值 {args.min_accuracy}")
+        sys.exit(1)
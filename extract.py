@@ -1,9 +1,14 @@
 import json
 import re
 import argparse
+from functools import lru_cache
 from tqdm import tqdm
 import Levenshtein
 
+from routing import RuleRouter, load_key_extractors
+from rule_store import RuleStore
+from metrics import create_metrics, NULL_METRICS, profiled
+
 
 def clean_log_text(log_text, use_extra_clean=False):
     log_text = log_text.strip()
@@ -15,86 +20,196 @@ def clean_log_text(log_text, use_extra_clean=False):
 
 
 class LogParser:
-    def __init__(self, rules_file):
-        with open(rules_file, encoding="utf-8") as f:
-            self.rules = json.load(f)
-        self._compile_rules()
+    def __init__(self, rules_file=None, compact=False, metrics=None):
+        # 未指定规则文件时从空规则集开始，可通过 add_rule 逐条加入
+        self.rules = []
+        self.router = None
+        self.store = None
+        # 未开启统计时使用空实现；开启时才换成带阶段计时的 match，热路径上不保留计时代码
+        self.metrics = metrics or NULL_METRICS
+        if self.metrics is not NULL_METRICS:
+            self.match = self._timed_match
+        # 按规则列表（全部规则或路由分片）缓存的 (rule, compiled) 列表，匹配时直接遍历
+        self._pairs_cache = {}
+        if rules_file:
+            with open(rules_file, encoding="utf-8") as f:
+                self.rules = json.load(f)
+        if compact:
+            # 紧凑存储：规则按需编译，不保留原始 JSON 字典
+            self.store = RuleStore(self.rules)
+            self.rules = self.store.records
+        else:
+            self._compile_rules()
 
     def _compile_rules(self, use_extra_replace=False):
         for rule in self.rules:
-            try:
-                pattern = rule["pattern"]
-                if use_extra_replace:
-                    pattern = re.sub(r"\\-", "_", pattern)
-                compiled = re.compile(pattern)
-                rule["compiled"] = compiled
-                rule["field_names"] = list(compiled.groupindex.keys())
-            except re.error as e:
-                print(f"规则编译失败：{rule['pattern']} - {str(e)}")
+            self._compile_rule(rule, use_extra_replace)
 
-    def parse_log(self, log_text):
-        log_text = clean_log_text(log_text)
+    def _compile_rule(self, rule, use_extra_replace=False):
+        try:
+            pattern = rule["pattern"]
+            if use_extra_replace:
+                pattern = re.sub(r"\\-", "_", pattern)
+            compiled = re.compile(pattern)
+            rule["compiled"] = compiled
+            rule["field_names"] = list(compiled.groupindex.keys())
+        except re.error as e:
+            print(f"规则编译失败：{rule['pattern']} - {str(e)}")
+
+    def add_rule(self, rule):
+        """编译并加入一条新规则"""
+        if self.store:
+            rule = self.store.add(rule)
+        else:
+            self._compile_rule(rule)
+        self.rules.append(rule)
+        if self.router:
+            self.router.add_rule(rule)
+
+    def enable_routing(self, extractors=None, learn=True):
+        """按日志头部的路由键对规则分片，之后只尝试对应分片中的规则"""
+        self.router = RuleRouter(self.rules, extractors, learn)
+        self._pairs_cache = {}
+
+    def _pairs(self, rules):
+        """规则列表对应的 (rule, compiled) 列表，规则列表增长后重建；紧凑存储下只在首次用到该列表时编译"""
+        cached = self._pairs_cache.get(id(rules))
+        if cached is None or cached[0] != len(rules):
+            pairs = []
+            for rule in rules:
+                compiled = rule.get("compiled")
+                if compiled is not None:
+                    pairs.append((rule, compiled))
+            cached = self._pairs_cache[id(rules)] = (len(rules), pairs)
+        return cached[1]
+
+    def match(self, log_text):
+        """只使用原始规则匹配（不走相似度回退），返回 priority 最高的 (rule, match)，未匹配返回 (None, None)"""
+        return self._match_clean(clean_log_text(log_text))
+
+    def _timed_match(self, log_text):
+        with self.metrics.stage("clean"):
+            log_text = clean_log_text(log_text)
+        with self.metrics.stage("match"):
+            return self._match_clean(log_text)
+
+    def _match_clean(self, log_text):
+        if self.router:
+            shard = self.router.route(log_text)
+            if shard is not None:
+                selected = self._select(self._pairs(shard), log_text)
+                if selected[0]:
+                    return selected
+                # 分片内没有匹配时退回全部规则
+                self.router.shard_misses += 1
+        return self._select(self._pairs(self.rules), log_text)
+
+    @staticmethod
+    def _select(pairs, log_text):
         matched = []
-        for rule in self.rules:
-            if "compiled" not in rule:
-                continue
-            m = rule["compiled"].search(log_text)
+        for rule, compiled in pairs:
+            m = compiled.search(log_text)
             if m:
                 matched.append((rule, m))
-        if matched:
-            selected_rule, selected_match = max(matched, key=lambda x: x[0].get("priority", 0))
+        if not matched:
+            return None, None
+        return max(matched, key=lambda x: x[0].get("priority", 0))
+
+    def parse_log(self, log_text):
+        selected_rule, selected_match = self.match(log_text)
+        if selected_rule:
+            self.metrics.inc("matches")
             group_dict = selected_match.groupdict()
             return [{"name": k, "value": v.strip() if v else ""} for k, v in group_dict.items()], None
+        self.metrics.inc("fallbacks")
+        with self.metrics.stage("fallback"):
+            return self.fallback(log_text)
 
+    def fallback(self, log_text):
+        """原始规则均未匹配时，按示例相似度选择最相似的规则进行提取"""
         log_text_clean = clean_log_text(log_text, use_extra_clean=True)
-        temp_rules = []
-        for r in self.rules:
-            try:
-                temp_rule = r.copy()
-                temp_rule["pattern"] = re.sub(r"\\-", "_", temp_rule["pattern"])
-                compiled = re.compile(temp_rule["pattern"])
-                temp_rule["compiled"] = compiled
-                temp_rule["field_names"] = list(compiled.groupindex.keys())
-                temp_rules.append(temp_rule)
-            except re.error as e:
-                continue
-
-        if not temp_rules:
-            return [], "所有规则均无效"
-
         similarities = []
-        for temp_rule in temp_rules:
+        for r in self.rules:
+            examples = r.get("examples", [])
             min_dist = float('inf')
-            for example in temp_rule.get("examples", []):
+            for example in examples:
                 dist = Levenshtein.distance(log_text_clean, example)
                 if dist < min_dist:
                     min_dist = dist
-            max_len = max(len(log_text_clean), max((len(e) for e in temp_rule.get("examples", [""])), default=1))
+            max_len = max(len(log_text_clean), max((len(e) for e in examples), default=1))
             similarity = 1 - (min_dist / max_len)
-            similarities.append((temp_rule, similarity))
-
-        if not similarities:
-            return [], "无法计算相似度"
+            similarities.append((similarity, r.get("priority", 0), r))
 
-        most_similar_rule = max(similarities, key=lambda x: (x[1], x[0].get("priority", 0)))[0]
-        m = most_similar_rule["compiled"].search(log_text_clean)
-        group_dict = m.groupdict() if m else {fn: "" for fn in most_similar_rule.get("field_names", [])}
+        # 只编译选中的规则；\- 替换后无法编译的规则不参与选择，依次取下一条
+        while similarities:
+            best = max(range(len(similarities)), key=lambda i: similarities[i][:2])
+            compiled = _fallback_compiled(similarities[best][2]["pattern"])
+            if compiled is not None:
+                break
+            similarities.pop(best)
+        else:
+            return [], "所有规则均无效"
+        m = compiled.search(log_text_clean)
+        group_dict = m.groupdict() if m else {fn: "" for fn in compiled.groupindex}
         fields = [{"name": k, "value": v.strip() if v else ""} for k, v in group_dict.items()]
         return fields, None
 
 
-def process_data(input_file, output_file, rules_file):
-    parser = LogParser(rules_file)
-    with open(input_file, 'r', encoding="utf-8") as f:
-        data = json.load(f)
+@lru_cache(maxsize=256)
+def _fallback_compiled(pattern):
+    """编译 \\- 替换为 _ 后的正则，编译失败返回 None；只缓存最近使用的规则，避免为每条规则常驻第二份正则"""
+    try:
+        return re.compile(re.sub(r"\\-", "_", pattern))
+    except re.error:
+        return None
+
+
+def process_data(input_file, output_file, rules_file, deferred_fallback=False, routing=False, routing_config=None,
+                 compact=False, metrics_file=None, metrics_interval=None):
+    metrics = create_metrics("extract", metrics_file, metrics_interval)
+    parser = LogParser(rules_file, compact, metrics)
+    if routing:
+        parser.enable_routing(load_key_extractors(routing_config) if routing_config else None)
+    with metrics.stage("load"):
+        with open(input_file, 'r', encoding="utf-8") as f:
+            data = json.load(f)
     results = []
-    for item in tqdm(data, desc="解析日志"):
-        fields, _ = parser.parse_log(item['logText'])
+    if deferred_fallback:
+        # 未匹配日志先收集起来，全部解析完后按模板批量回退
+        from batch_fallback import BatchFallback
+        fallback = BatchFallback(parser.rules, empty_on_miss=True)
+    for i, item in enumerate(tqdm(data, desc="解析日志")):
+        metrics.inc("logs")
+        if deferred_fallback:
+            rule, m = parser.match(item['logText'])
+            if not rule:
+                fallback.add(i, item['logText'])
+                results.append(item)
+                continue
+            metrics.inc("matches")
+            fields = [{"name": k, "value": v.strip() if v else ""} for k, v in m.groupdict().items()]
+        else:
+            fields, _ = parser.parse_log(item['logText'])
         item['logField'] = fields
         results.append(item)
-    with open(output_file, 'w', encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+        metrics.maybe_write()
+    if deferred_fallback:
+        with metrics.stage("fallback"):
+            resolved = fallback.resolve()
+        metrics.inc("fallbacks", len(resolved))
+        for i, (fields, _) in resolved.items():
+            results[i]['logField'] = fields
+    with metrics.stage("serialize"):
+        with open(output_file, 'w', encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    metrics.write()
     print(f"解析完成，结果保存至：{output_file}")
+    if metrics_file:
+        print(f"运行指标已保存至：{metrics_file}")
+    if parser.router:
+        print(f"规则路由统计：{parser.router.report()}")
+    if parser.store:
+        print(f"规则存储内存估算：{parser.store.memory_report()}")
 
 
 if __name__ == "__main__":
@@ -102,5 +217,14 @@ if __name__ == "__main__":
     parser.add_argument("--input_file", required=True)
     parser.add_argument("--output_file", required=True)
     parser.add_argument("--rules_file", default="classified_rules.json")
+    parser.add_argument("--deferred_fallback", action="store_true", help="未匹配日志按模板去重后批量回退")
+    parser.add_argument("--routing", action="store_true", help="按日志头部路由键只尝试对应分片的规则")
+    parser.add_argument("--routing_config", default=None, help="路由键提取正则列表（JSON 文件），默认使用内置规则")
+    parser.add_argument("--compact_rules", action="store_true", help="使用紧凑的规则存储，规则按需编译")
+    parser.add_argument("--metrics_file", default=None, help="运行指标输出路径（Prometheus 文本格式），同时写出同名 .summary.json 摘要")
+    parser.add_argument("--metrics_interval", type=float, default=None, help="每隔多少秒写出一次运行指标（可选）")
+    parser.add_argument("--profile", default=None, help="在性能分析器下运行并把结果保存到该路径（可选）")
     args = parser.parse_args()
-    process_data(args.input_file, args.output_file, args.rules_file)
\ No newline at end of file
+    with profiled(args.profile):
+        process_data(args.input_file, args.output_file, args.rules_file, args.deferred_fallback, args.routing,
+                     args.routing_config, args.compact_rules, args.metrics_file, args.metrics_interval)
\ No newline at end of file
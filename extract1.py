@@ -4,6 +4,11 @@ import argparse
 from tqdm import tqdm
 import Levenshtein
 
+from tracing import Tracer, OFF, DEBUG
+from routing import RuleRouter, load_key_extractors
+from metrics import create_metrics, NULL_METRICS, profiled
+from columnar import write_columnar, COMPRESSIONS
+
 
 def clean_log_text(log_text, use_extra_clean=False):
     # 去除前后空白字符和不可见字符
@@ -17,64 +22,134 @@ def clean_log_text(log_text, use_extra_clean=False):
 
 
 class LogParser:
-    def __init__(self, rules_file):
+    def __init__(self, rules_file, tracer=None, metrics=None):
         # 加载平铺结构的规则列表
         with open(rules_file, encoding="utf-8") as f:
             self.rules = json.load(f)
-        self._compile_rules(use_extra_replace=False)
+        # 默认关闭追踪，热路径上只做一次级别判断
+        self.tracer = tracer or Tracer()
+        # 未开启统计时使用空实现；开启时才换成带阶段计时的 clean / match，热路径上不保留计时代码
+        self.metrics = metrics or NULL_METRICS
+        if self.metrics is not NULL_METRICS:
+            self.clean = self._timed_clean
+            self.match = self._timed_match
+        self.router = None
+        self._compile_rules(use_extra_replace=False, level=self.tracer.level)
 
-    def _compile_rules(self, use_extra_replace=False):
+    def _compile_rules(self, use_extra_replace=False, level=OFF):
         """编译所有规则中的正则表达式，并存入 rule['compiled']"""
+        trace = level >= DEBUG
         for rule in self.rules:
             try:
                 if use_extra_replace:
                     # 将 \- 替换为下划线 _
                     rule["pattern"] = re.sub(r"\\-", "_", rule["pattern"])
                 rule["compiled"] = re.compile(rule["pattern"])
-                print(f"[DEBUG] 规则编译成功：{rule['pattern']}")
+                if trace:
+                    self.tracer.emit("compile", pattern=rule["pattern"])
             except re.error as e:
                 print(f"规则编译失败：{rule['pattern']} - {str(e)}")
 
-    def parse_log(self, log_text):
-        log_text = clean_log_text(log_text, use_extra_clean=False)
-        print(f"[DEBUG] 待匹配的日志文本: {log_text}")
-        """遍历所有规则，匹配成功则返回匹配到的命名捕获组字段，若有多个匹配则选择 priority 最高的规则"""
+    def enable_routing(self, extractors=None, learn=True):
+        """按日志头部的路由键对规则分片，之后只尝试对应分片中的规则"""
+        self.router = RuleRouter(self.rules, extractors, learn)
+
+    # 提取前的基础清洗
+    clean = staticmethod(clean_log_text)
+
+    def _timed_clean(self, log_text):
+        with self.metrics.stage("clean"):
+            return clean_log_text(log_text)
+
+    def _timed_match(self, log_text, level=OFF):
+        with self.metrics.stage("match"):
+            return self._match(log_text, level)
+
+    def _match(self, log_text, level=OFF):
+        """只使用原始规则匹配，返回所有匹配成功的 (rule, match)"""
+        if self.router:
+            shard = self.router.route(log_text)
+            if shard is not None:
+                matched = self._match_rules(shard, log_text, level)
+                if matched:
+                    return matched
+                # 分片内没有匹配时退回全部规则
+                self.router.shard_misses += 1
+        return self._match_rules(self.rules, log_text, level)
+
+    match = _match
+
+    def _match_rules(self, rules, log_text, level):
         matched = []
-        for rule in self.rules:
+        if level < DEBUG:
+            for rule in rules:
+                compiled = rule.get("compiled")
+                if compiled is not None:
+                    m = compiled.search(log_text)
+                    if m:
+                        matched.append((rule, m))
+            return matched
+
+        for rule in rules:
             if "compiled" not in rule:
                 continue
-            print(f"[DEBUG] 尝试用规则 {rule['pattern']} 匹配日志：{log_text}")
             m = rule["compiled"].search(log_text)
+            self.tracer.emit("try_rule", pattern=rule["pattern"], matched=bool(m))
             if m:
-                print(f"[DEBUG] 匹配成功：{rule['pattern']}")
                 matched.append((rule, m))
+        return matched
+
+    def parse_log(self, log_text):
+        """遍历所有规则，匹配成功则返回匹配到的命名捕获组字段，若有多个匹配则选择 priority 最高的规则"""
+        fields, reason, _ = self.parse(log_text)
+        return fields, reason
+
+    def parse(self, log_text):
+        """与 parse_log 相同，额外返回选中的规则（未匹配时为 None）"""
+        log_text = self.clean(log_text)
+        level = self.tracer.begin()
+        if level >= DEBUG:
+            self.tracer.emit("parse", log=log_text)
+        matched = self.match(log_text, level)
         if not matched:
-            print(f"[DEBUG] 没有找到匹配规则：{log_text}")
-            # 对无标签日志使用额外清洗和规则处理
-            log_text_similarity = clean_log_text(log_text, use_extra_clean=True)
-            self._compile_rules(use_extra_replace=True)
-            # 找出与各规则的相似度
-            similarities = self.find_similarities(log_text_similarity)
-            most_similar_rule = self.find_most_similar_rule(similarities)
-            if most_similar_rule:
-                print(f"[DEBUG] 尝试使用最相似规则 {most_similar_rule['pattern']} 匹配日志：{log_text_similarity}")
-                m = most_similar_rule["compiled"].search(log_text_similarity)
-                if m:
-                    print(f"[DEBUG] 最相似规则匹配成功：{most_similar_rule['pattern']}")
-                    group_dict = m.groupdict()
-                    return [{"name": k, "value": (v.strip() if v else "")} for k, v in group_dict.items()], None
-                else:
-                    print(f"[DEBUG] 最相似规则 {most_similar_rule['pattern']} 匹配失败，日志文本: {log_text_similarity}")
-            # 输出各规则相似度信息
-            print("\n各规则与该日志的相似度：")
-            for idx, (rule, sim) in enumerate(similarities):
-                print(f"规则 {idx + 1}（正则: {rule['pattern']}）相似度: {sim}")
-            return [], "没有找到匹配规则"
+            self.metrics.inc("fallbacks")
+            with self.metrics.stage("fallback"):
+                return self.fallback(log_text, level)
+
+        self.metrics.inc("matches")
+        return self.select(matched, log_text, level)
 
+    def select(self, matched, log_text, level=OFF):
+        """从 match 的结果中选择规则提取字段，返回 (fields, None, rule)"""
         # 按 priority（优先级数值越大优先）选择规则，若无 priority 则视为 0
         selected_rule, selected_match = max(matched, key=lambda x: x[0].get("priority", 0))
         group_dict = selected_match.groupdict()
-        return [{"name": k, "value": (v.strip() if v else "")} for k, v in group_dict.items()], None
+        if level:
+            self.tracer.emit("match", log=log_text, pattern=selected_rule["pattern"], fields=group_dict)
+        return [{"name": k, "value": (v.strip() if v else "")} for k, v in group_dict.items()], None, selected_rule
+
+    def fallback(self, log_text, level=OFF):
+        """原始规则均未匹配时，对日志做额外清洗并按示例相似度选择规则提取，返回 (fields, reason, rule)"""
+        log_text_similarity = clean_log_text(log_text, use_extra_clean=True)
+        self._compile_rules(use_extra_replace=True, level=level)
+        # 找出与各规则的相似度
+        similarities = self.find_similarities(log_text_similarity)
+        most_similar_rule = self.find_most_similar_rule(similarities)
+        if level >= DEBUG:
+            for idx, (rule, sim) in enumerate(similarities):
+                self.tracer.emit("similarity", rule=idx + 1, pattern=rule["pattern"], similarity=sim)
+        if most_similar_rule:
+            m = most_similar_rule["compiled"].search(log_text_similarity)
+            if level:
+                self.tracer.emit("fallback", log=log_text_similarity, pattern=most_similar_rule["pattern"],
+                                 matched=bool(m))
+            if m:
+                group_dict = m.groupdict()
+                fields = [{"name": k, "value": (v.strip() if v else "")} for k, v in group_dict.items()]
+                return fields, None, most_similar_rule
+        if level:
+            self.tracer.emit("unmatched", log=log_text)
+        return [], "没有找到匹配规则", None
 
     def find_similarities(self, log_text):
         """计算日志文本与各规则的相似度"""
@@ -97,20 +172,51 @@ class LogParser:
         return None
 
 
-def extract(unlabeled_data_file_path: str, rules_save_file_path: str, result_file_path: str) -> None:
+def extract(unlabeled_data_file_path: str, rules_save_file_path: str, result_file_path: str,
+            deferred_fallback: bool = False, tracer: Tracer = None, routing: bool = False,
+            routing_config: str = None, metrics_file: str = None, metrics_interval: float = None,
+            output_format: str = "json", compression: str = None) -> None:
 
-    parser = LogParser(rules_save_file_path)
+    metrics = create_metrics("extract", metrics_file, metrics_interval)
+    parser = LogParser(rules_save_file_path, tracer, metrics)
+    if routing:
+        parser.enable_routing(load_key_extractors(routing_config) if routing_config else None)
+    if deferred_fallback:
+        # 未匹配日志先收集起来，全部解析完后按模板批量回退
+        from batch_fallback import BatchFallback
+        fallback = BatchFallback(parser.rules, empty_on_miss=False, min_similarity=0, use_priority=False)
 
-    with open(unlabeled_data_file_path, 'r', encoding="utf-8") as f:
-        data = json.load(f)
+    with metrics.stage("load"):
+        with open(unlabeled_data_file_path, 'r', encoding="utf-8") as f:
+            data = json.load(f)
 
     results = []
+    record_rules = []  # 每条结果选中的规则，列式输出时用于分组
     unmatched_logs = []  # 用于记录没有匹配上的日志
+    traced = {}  # 延迟回退时被采样追踪的日志及其追踪级别，回退完成后补记结果
 
-    for item in tqdm(data, desc="解析日志"):
-        fields, reason = parser.parse_log(item['logText'])
+    for i, item in enumerate(tqdm(data, desc="解析日志")):
+        metrics.inc("logs")
+        if deferred_fallback:
+            log_text = parser.clean(item['logText'])
+            level = parser.tracer.begin()
+            if level >= DEBUG:
+                parser.tracer.emit("parse", log=log_text)
+            matched = parser.match(log_text, level)
+            if not matched:
+                fallback.add(i, item['logText'])
+                if level:
+                    traced[i] = level
+                results.append(item)
+                record_rules.append(None)
+                continue
+            metrics.inc("matches")
+            fields, reason, rule = parser.select(matched, log_text, level)
+        else:
+            fields, reason, rule = parser.parse(item['logText'])
 
         if reason:
+            metrics.inc("unmatched")
             unmatched_logs.append({
                 "logText": item["logText"],
                 "reason": reason
@@ -118,11 +224,45 @@ def extract(unlabeled_data_file_path: str, rules_save_file_path: str, result_fil
 
         item['logField'] = fields
         results.append(item)
+        record_rules.append(rule)
+        metrics.maybe_write()
+
+    if deferred_fallback:
+        with metrics.stage("fallback"):
+            resolved = fallback.resolve(with_rules=True)
+        metrics.inc("fallbacks", len(resolved))
+        for i, (fields, reason, rule) in resolved.items():
+            if i in traced:
+                # 批量回退没有逐条规则的相似度，DEBUG 级别也只记录选中的规则
+                if rule:
+                    parser.tracer.emit("fallback", log=clean_log_text(results[i]["logText"], use_extra_clean=True),
+                                       pattern=rule["pattern"], matched=True)
+                else:
+                    parser.tracer.emit("unmatched", log=clean_log_text(results[i]["logText"]))
+            if reason:
+                metrics.inc("unmatched")
+                unmatched_logs.append({
+                    "logText": results[i]["logText"],
+                    "reason": reason
+                })
+            results[i]['logField'] = fields
+            record_rules[i] = rule
 
-    with open(result_file_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=4)
+    with metrics.stage("serialize"):
+        if output_format == "columnar":
+            # 按匹配规则分组的列式输出，可用 columnar.iter_records 读回
+            write_columnar(result_file_path, results, record_rules, parser.rules, compression)
+        else:
+            with open(result_file_path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=4)
 
+    parser.tracer.close()
+    metrics.write()
     print(f"\n解析完成，结果已保存到：{result_file_path}")
+    if metrics_file:
+        print(f"运行指标已保存到：{metrics_file}")
+    if parser.router:
+        print(f"规则路由统计：{parser.router.report()}")
 
     if unmatched_logs:
         print("\n以下日志未能匹配到规则：")
@@ -137,7 +277,23 @@ if __name__ == "__main__":
     parser.add_argument("--unlabeled_data_file_path", required=True, help="待解析的无标签数据路径")
     parser.add_argument("--rules_save_file_path", required=True, help="规则文件路径")
     parser.add_argument("--result_file_path", required=True, help="解析结果保存路径")
+    parser.add_argument("--deferred_fallback", action="store_true", help="未匹配日志按模板去重后批量计算相似度回退")
+    parser.add_argument("--trace_level", default="off", choices=["off", "info", "debug"], help="解析追踪级别，默认关闭")
+    parser.add_argument("--trace_sample_rate", type=float, default=1.0, help="追踪采样比例（0~1）")
+    parser.add_argument("--trace_file", default=None, help="追踪输出文件（JSON Lines），不指定时输出到控制台")
+    parser.add_argument("--routing", action="store_true", help="按日志头部路由键只尝试对应分片的规则")
+    parser.add_argument("--routing_config", default=None, help="路由键提取正则列表（JSON 文件），默认使用内置规则")
+    parser.add_argument("--metrics_file", default=None, help="运行指标输出路径（Prometheus 文本格式），同时写出同名 .summary.json 摘要")
+    parser.add_argument("--metrics_interval", type=float, default=None, help="每隔多少秒写出一次运行指标（可选）")
+    parser.add_argument("--profile", default=None, help="在性能分析器下运行并把结果保存到该路径（可选）")
+    parser.add_argument("--output_format", default="json", choices=["json", "columnar"],
+                        help="结果格式：json（默认）或按规则分组、字典编码的列式格式")
+    parser.add_argument("--compression", default="none", choices=COMPRESSIONS, help="列式结果的压缩方式")
 
     args = parser.parse_args()
 
-    extract(args.unlabeled_data_file_path, args.rules_save_file_path, args.result_file_path)
\ No newline at end of file
+    tracer = Tracer(args.trace_level, args.trace_sample_rate, args.trace_file)
+    with profiled(args.profile):
+        extract(args.unlabeled_data_file_path, args.rules_save_file_path, args.result_file_path,
+                args.deferred_fallback, tracer, args.routing, args.routing_config, args.metrics_file,
+                args.metrics_interval, args.output_format, args.compression)
\ No newline at end of file
@@ -5,14 +5,20 @@ import time
 from huggingface_hub import InferenceClient
 from dotenv import load_dotenv
 
+from synthesize import RuleSynthesizer
+from rule_coverage import RuleCoverage
+from optimize import optimize_rules
+from metrics import create_metrics, NULL_METRICS, profiled, record_usage
+
 # 加载环境变量
 load_dotenv()
 api_key = os.getenv("HUGGINGFACE_API_KEY")
 
 class RuleGenerator:
-    def __init__(self, api_key, model_name):
+    def __init__(self, api_key, model_name, metrics=None):
         self.client = InferenceClient(api_key=api_key)
         self.model_name = model_name
+        self.metrics = metrics or NULL_METRICS
 
     def analyze_log(self, log_text, log_fields):
         # 预处理日志，移除优先级字段
@@ -41,12 +47,15 @@ class RuleGenerator:
         while retry_count < max_retries:
             try:
                 # 调用 Huggingface API 获取生成的规则
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.2,
-                    max_tokens=2000
-                )
+                self.metrics.inc("llm_calls")
+                with self.metrics.stage("llm"):
+                    response = self.client.chat.completions.create(
+                        model=self.model_name,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.2,
+                        max_tokens=2000
+                    )
+                record_usage(self.metrics, response)
                 output = response.choices[0].message.content.strip()
 
                 if not output:
@@ -58,23 +67,49 @@ class RuleGenerator:
             except Exception as e:
                 retry_count += 1
                 if retry_count >= max_retries:
+                    self.metrics.inc("llm_errors")
                     print(f"错误：{str(e)}")
                     return None
+                self.metrics.inc("llm_retries")
                 print(f"重试第 {retry_count} 次... 错误信息：{str(e)}")
-                time.sleep(1)  # 等待 1 秒后重试
-
-def generate(labeled_data_file, rules_file, api_key, model_name):
-    generator = RuleGenerator(api_key, model_name)
+                with self.metrics.stage("retry_wait"):
+                    time.sleep(1)  # 等待 1 秒后重试
+
+def generate(labeled_data_file, rules_file, api_key, model_name, use_synthesizer=True, seed_rules_file=None,
+             use_optimizer=True, metrics_file=None, metrics_interval=None):
+    metrics = create_metrics("generate", metrics_file, metrics_interval)
+    generator = RuleGenerator(api_key, model_name, metrics)
+    # 本地规则合成器，能直接处理的日志不再调用大模型
+    synthesizer = RuleSynthesizer() if use_synthesizer else None
+    # 已接受规则的覆盖检查，可从已有规则文件开始
+    coverage = RuleCoverage(seed_rules_file)
+
+    with metrics.stage("load"):
+        with open(labeled_data_file, encoding="utf-8") as f:
+            data = json.load(f)
 
-    with open(labeled_data_file, encoding="utf-8") as f:
-        data = json.load(f)
-
-    rules_dict = {}  # 用于去重的规则字典
     error_logs = []  # 错误日志
 
     for i, item in enumerate(data):
+        metrics.inc("logs")
+        metrics.maybe_write()
         try:
-            rule = generator.analyze_log(item['logText'], item['logField'])
+            # 已被现有规则正确覆盖的日志只补充示例，不再生成规则
+            with metrics.stage("coverage"):
+                covered_rule = coverage.covering_rule(item['logText'], item['logField'])
+            if covered_rule:
+                metrics.inc("covered")
+                coverage.add_example(covered_rule, item['logText'])
+                continue
+
+            rule = None
+            if synthesizer:
+                with metrics.stage("synthesize"):
+                    rule = synthesizer.synthesize(item['logText'], item['logField'])
+                if rule is not None:
+                    metrics.inc("synthesized")
+            if rule is None:
+                rule = generator.analyze_log(item['logText'], item['logField'])
             if rule:
                 pattern = rule.get("pattern", "").strip()
                 if not pattern:
@@ -86,25 +121,27 @@ def generate(labeled_data_file, rules_file, api_key, model_name):
                     error_logs.append(f"日志 {i+1} 无效正则表达式：{str(e)}")
                     continue
 
-                if pattern in rules_dict:
-                    existing_ex = rules_dict[pattern].get("examples", [])
-                    new_ex = rule.get("examples", [])
-                    for ex in new_ex:
-                        if ex not in existing_ex:
-                            existing_ex.append(ex)
-                    rules_dict[pattern]["examples"] = existing_ex
-                else:
-                    rules_dict[pattern] = rule
+                coverage.accept(rule)
+                metrics.inc("rules")
 
         except Exception as e:
             error_logs.append(f"日志 {i+1} 处理失败：{str(e)}")
             continue
 
-    final_rules = list(rules_dict.values())
+    final_rules = coverage.export()
+    if use_optimizer:
+        # 在全部示例上校验等价后改写为更快的正则
+        with metrics.stage("optimize"):
+            final_rules, _ = optimize_rules(final_rules)
+    print(f"{coverage.covered_count} 条日志已被现有规则覆盖，未调用大模型")
 
     # 保存规则到文件
-    with open(rules_file, "w", encoding="utf-8") as f:
-        json.dump(final_rules, f, indent=2, ensure_ascii=False)
+    with metrics.stage("serialize"):
+        with open(rules_file, "w", encoding="utf-8") as f:
+            json.dump(final_rules, f, indent=2, ensure_ascii=False)
+
+    metrics.inc("errors", len(error_logs))
+    metrics.write()
 
     # 返回错误日志
     return final_rules, error_logs
@@ -118,6 +155,16 @@ if __name__ == "__main__":
     parser.add_argument("--rules_file", default="classified_rules.json")
     parser.add_argument("--api_key", required=True)
     parser.add_argument("--model", default="Qwen/Qwen2.5-72B-Instruct")
+    parser.add_argument("--disable_synthesizer", action="store_true")
+    parser.add_argument("--seed_rules_file", default=None)
+    parser.add_argument("--disable_optimizer", action="store_true")
+    parser.add_argument("--metrics_file", default=None, help="运行指标输出路径（Prometheus 文本格式），同时写出同名 .summary.json 摘要")
+    parser.add_argument("--metrics_interval", type=float, default=None, help="每隔多少秒写出一次运行指标（可选）")
+    parser.add_argument("--profile", default=None, help="在性能分析器下运行并把结果保存到该路径（可选）")
 
     args = parser.parse_args()
-    generate(args.labeled_data_file, args.rules_file, args.api_key, args.model)
+    with profiled(args.profile):
+        generate(args.labeled_data_file, args.rules_file, args.api_key, args.model,
+                 use_synthesizer=not args.disable_synthesizer, seed_rules_file=args.seed_rules_file,
+                 use_optimizer=not args.disable_optimizer, metrics_file=args.metrics_file,
+                 metrics_interval=args.metrics_interval)
@@ -4,21 +4,32 @@ import re
 from dotenv import load_dotenv
 import os
 import time
-from openai import OpenAI
+from openai import OpenAI, RateLimitError, InternalServerError, APIConnectionError
+
+from synthesize import RuleSynthesizer
+from rule_coverage import RuleCoverage
+from optimize import optimize_rules
+from metrics import create_metrics, NULL_METRICS, profiled, record_usage
+
+# 本地模型服务地址，可通过环境变量 LOCAL_LLM_BASE_URL 覆盖（例如指向 mock_llm.py 启动的模拟服务）
+LOCAL_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", 'http://localhost:11434/v1/')
 
 # 初始化客户端连接
+# SDK 默认会在内部重试 429/5xx，关闭后统一由 RuleGenerator 的重试循环处理并计入 llm_retries
 
 client = OpenAI(
-    base_url='http://localhost:11434/v1/',
+    base_url=LOCAL_BASE_URL,
     api_key='ollama',  # 本地部署可忽略
+    max_retries=0,
 )
 
 
 def get_chat_completions(messages, api_key, base_url, use_llm_model, model_name, prompt):
     global client
     client = OpenAI(
-        base_url='http://localhost:11434/v1/',
+        base_url=LOCAL_BASE_URL,
         api_key='ollama',  # 本地部署可忽略
+        max_retries=0,
     )
     response = client.chat.completions.create(
                     model= model_name,
@@ -31,8 +42,9 @@ def get_chat_completions(messages, api_key, base_url, use_llm_model, model_name,
 
 
 class RuleGenerator:
-    def __init__(self, model_name):
+    def __init__(self, model_name, metrics=None):
         self.model_name = model_name
+        self.metrics = metrics or NULL_METRICS
 
     def analyze_log(self, log_text, log_fields):
         preprocessed_log = re.sub(r'<\d+>', '', log_text)
@@ -64,7 +76,10 @@ class RuleGenerator:
 
         while retry_count < max_retries:
             try:
-                response = get_chat_completions(None, None, None, None, self.model_name, prompt)
+                self.metrics.inc("llm_calls")
+                with self.metrics.stage("llm"):
+                    response = get_chat_completions(None, None, None, None, self.model_name, prompt)
+                record_usage(self.metrics, response)
                 output = response.choices[0].message.content
 
                 # 清理响应内容（保持原有处理逻辑不变）
@@ -77,38 +92,79 @@ class RuleGenerator:
                 return rule
             except json.JSONDecodeError as e:
                 retry_count += 1
+                if retry_count < max_retries:
+                    self.metrics.inc("llm_retries")
                 print(f"JSON解析失败，重试第{retry_count}次...")
-                time.sleep(1)
+                with self.metrics.stage("retry_wait"):
+                    time.sleep(1)
+            except (RateLimitError, InternalServerError, APIConnectionError) as e:
+                # 客户端已关闭内置重试，限流、服务端错误和连接错误在这里重试
+                retry_count += 1
+                if retry_count < max_retries:
+                    self.metrics.inc("llm_retries")
+                print(f"接口调用失败，重试第{retry_count}次... 错误信息：{str(e)}")
+                with self.metrics.stage("retry_wait"):
+                    time.sleep(1)
             except Exception as e:
                 print(f"发生错误：{str(e)}")
                 break
+        self.metrics.inc("llm_errors")
         return None
 
 
-def generate(labeled_data_file, rules_file, model_name):
-    generator = RuleGenerator(model_name)
+def generate(labeled_data_file, rules_file, model_name, use_synthesizer=True, seed_rules_file=None,
+             use_optimizer=True, metrics_file=None, metrics_interval=None):
+    metrics = create_metrics("generate", metrics_file, metrics_interval)
+    generator = RuleGenerator(model_name, metrics)
+    # 本地规则合成器，能直接处理的日志不再调用大模型
+    synthesizer = RuleSynthesizer() if use_synthesizer else None
+    # 已接受规则的覆盖检查，可从已有规则文件开始
+    coverage = RuleCoverage(seed_rules_file)
 
-    with open(labeled_data_file, encoding="utf-8") as f:
-        data = json.load(f)
+    with metrics.stage("load"):
+        with open(labeled_data_file, encoding="utf-8") as f:
+            data = json.load(f)
 
-    rules_dict = {}
     for item in data:
-        rule = generator.analyze_log(item['logText'], item['logField'])
+        metrics.inc("logs")
+        metrics.maybe_write()
+        # 已被现有规则正确覆盖的日志只补充示例，不再生成规则
+        with metrics.stage("coverage"):
+            covered_rule = coverage.covering_rule(item['logText'], item['logField'])
+        if covered_rule:
+            metrics.inc("covered")
+            coverage.add_example(covered_rule, item['logText'])
+            continue
+
+        rule = None
+        if synthesizer:
+            with metrics.stage("synthesize"):
+                rule = synthesizer.synthesize(item['logText'], item['logField'])
+            if rule is not None:
+                metrics.inc("synthesized")
+        if rule is None:
+            rule = generator.analyze_log(item['logText'], item['logField'])
         if rule:
             # 保持原有验证和去重逻辑不变
             pattern = rule.get("pattern", "").strip()
             if pattern and re.compile(pattern):
-                if pattern in rules_dict:
-                    rules_dict[pattern]["examples"] = list(
-                        set(rules_dict[pattern]["examples"] + rule.get("examples", []))
-                    )
-                else:
-                    rules_dict[pattern] = rule
+                coverage.accept(rule)
+                metrics.inc("rules")
+            else:
+                metrics.inc("errors")
+
+    final_rules = coverage.export()
+    if use_optimizer:
+        # 在全部示例上校验等价后改写为更快的正则
+        with metrics.stage("optimize"):
+            final_rules, _ = optimize_rules(final_rules)
 
-    with open(rules_file, "w", encoding="utf-8") as f:
-        json.dump(list(rules_dict.values()), f, indent=2, ensure_ascii=False)
+    with metrics.stage("serialize"):
+        with open(rules_file, "w", encoding="utf-8") as f:
+            json.dump(final_rules, f, indent=2, ensure_ascii=False)
+    metrics.write()
 
-    print(f"规则生成完成：{rules_file}")
+    print(f"规则生成完成：{rules_file}，{coverage.covered_count} 条日志已被现有规则覆盖")
 
 
 if __name__ == "__main__":
@@ -116,6 +172,15 @@ if __name__ == "__main__":
     parser.add_argument("--labeled_data_file", required=True)
     parser.add_argument("--rules_file", default="classified_rules.json")
     parser.add_argument("--model", default="qwen2.5:7b")  # 适配本地模型名称
+    parser.add_argument("--disable_synthesizer", action="store_true")
+    parser.add_argument("--seed_rules_file", default=None)
+    parser.add_argument("--disable_optimizer", action="store_true")
+    parser.add_argument("--metrics_file", default=None, help="运行指标输出路径（Prometheus 文本格式），同时写出同名 .summary.json 摘要")
+    parser.add_argument("--metrics_interval", type=float, default=None, help="每隔多少秒写出一次运行指标（可选）")
+    parser.add_argument("--profile", default=None, help="在性能分析器下运行并把结果保存到该路径（可选）")
 
     args = parser.parse_args()
-    generate(args.labeled_data_file, args.rules_file, args.model)
\ No newline at end of file
+    with profiled(args.profile):
+        generate(args.labeled_data_file, args.rules_file, args.model, use_synthesizer=not args.disable_synthesizer,
+                 seed_rules_file=args.seed_rules_file, use_optimizer=not args.disable_optimizer,
+                 metrics_file=args.metrics_file, metrics_interval=args.metrics_interval)
\ No newline at end of file
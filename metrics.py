@@ -0,0 +1,170 @@
+import json
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class _StageTimer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.stage_seconds[self.name] += time.perf_counter() - self.start
+        self.metrics.stage_calls[self.name] += 1
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullMetrics:
+    """不记录任何内容的占位实现，未开启统计时热路径上只有一次空调用"""
+
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def inc(self, name, value=1):
+        pass
+
+    def write(self):
+        pass
+
+    def maybe_write(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def create_metrics(job, metrics_file=None, interval=None):
+    """指定了输出文件时才真正记录，否则返回空实现"""
+    if not metrics_file:
+        return NULL_METRICS
+    return Metrics(job, metrics_file, interval)
+
+
+class Metrics:
+    """运行阶段计时和计数，结束时（或定期）导出为 Prometheus 文本格式和 JSON 摘要"""
+
+    def __init__(self, job, metrics_file=None, interval=None):
+        self.job = job
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self.counters = Counter()
+        self.stage_seconds = Counter()
+        self.stage_calls = Counter()
+        self.start_time = time.time()
+        self._last_write = time.perf_counter()
+
+    def stage(self, name):
+        return _StageTimer(self, name)
+
+    def inc(self, name, value=1):
+        self.counters[name] += value
+
+    def summary(self):
+        elapsed = time.time() - self.start_time
+        return {
+            "job": self.job,
+            "start_time": self.start_time,
+            "elapsed_seconds": elapsed,
+            "counters": dict(self.counters),
+            "stages": {
+                name: {"seconds": self.stage_seconds[name], "calls": self.stage_calls[name]}
+                for name in self.stage_seconds
+            },
+        }
+
+    def to_prometheus(self):
+        prefix = f"logparse_{self.job}"
+        lines = [
+            f"# TYPE {prefix}_elapsed_seconds gauge",
+            f"{prefix}_elapsed_seconds {time.time() - self.start_time:.6f}",
+        ]
+        for name in sorted(self.counters):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {self.counters[name]}")
+        if self.stage_seconds:
+            lines.append(f"# TYPE {prefix}_stage_seconds_total counter")
+            for name in sorted(self.stage_seconds):
+                lines.append(f'{prefix}_stage_seconds_total{{stage="{name}"}} {self.stage_seconds[name]:.6f}')
+            lines.append(f"# TYPE {prefix}_stage_calls_total counter")
+            for name in sorted(self.stage_calls):
+                lines.append(f'{prefix}_stage_calls_total{{stage="{name}"}} {self.stage_calls[name]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """写出 Prometheus 文本文件以及同名的 .summary.json 摘要；先写临时文件再替换，避免采集到一半的内容"""
+        if not self.metrics_file:
+            return
+        summary_file = os.path.splitext(self.metrics_file)[0] + ".summary.json"
+        for path, content in ((self.metrics_file, self.to_prometheus()),
+                              (summary_file, json.dumps(self.summary(), indent=2, ensure_ascii=False))):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        self._last_write = time.perf_counter()
+
+    def maybe_write(self):
+        """长时间运行时按 interval 秒定期写出"""
+        if self.interval and time.perf_counter() - self._last_write >= self.interval:
+            self.write()
+
+
+def record_usage(metrics, response):
+    """累计接口返回的 token 用量，兼容 OpenAI 和 Hugging Face 的 usage 字段"""
+    usage = getattr(response, "usage", None)
+    if usage:
+        metrics.inc("prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+        metrics.inc("completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+
+
+@contextmanager
+def profiled(output_file):
+    """在采样分析器下运行；安装了 pyinstrument 时使用它，否则退回 cProfile"""
+    if not output_file:
+        yield
+        return
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+
+    if Profiler:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(output_file, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html() if output_file.endswith(".html") else profiler.output_text())
+    else:
+        import cProfile
+        print("未安装 pyinstrument，使用 cProfile 进行分析")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output_file)
+    print(f"性能分析结果已保存到：{output_file}")
@@ -0,0 +1,215 @@
+import json
+import random
+import re
+import threading
+import time
+import argparse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthesize import RuleSynthesizer
+
+
+_PROMPT_RE = re.compile(r"日志内容：(?P<log>.*?)\n\s*标注字段：(?P<fields>.*)$", re.S)
+
+
+def parse_latency(spec):
+    """解析延迟分布：fixed:0.2 / uniform:0.1,0.5 / exp:0.3 / lognormal:-1.5,0.5（单位：秒）"""
+    kind, _, args = (spec or "fixed:0").partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"未知的延迟分布：{spec}")
+
+
+def load_recordings(record_file):
+    """读取录制的响应（JSON Lines，每行 {"log": 预处理后的日志, "content": 模型返回的原始内容}）"""
+    recordings = {}
+    with open(record_file, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                recordings[item["log"]] = item["content"]
+    return recordings
+
+
+class MockLLMServer:
+    """本地模拟的 OpenAI / Hugging Face 兼容聊天接口，回放录制的响应或直接合成合法的规则 JSON"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency="fixed:0", error_rate=0.0, rate_limit_rate=0.0,
+                 malformed_rate=0.0, recordings=None, seed=None):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.recordings = recordings or {}
+        self.synthesizer = RuleSynthesizer()
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.status_counts = Counter()
+            self.prompt_counts = Counter()
+            self.malformed = 0
+            self.replayed = 0
+            self.completion_tokens = 0
+
+    def stats(self):
+        with self._lock:
+            requests = sum(self.status_counts.values())
+            return {
+                "requests": requests,
+                "distinct_prompts": len(self.prompt_counts),
+                # 相同提示词的重复请求：既可能是重试，也可能是重复的标注日志，重试次数以客户端统计为准
+                "repeated_prompts": requests - len(self.prompt_counts),
+                "status": dict(self.status_counts),
+                "malformed": self.malformed,
+                "replayed": self.replayed,
+                "completion_tokens": self.completion_tokens,
+            }
+
+    def _respond(self, body):
+        """返回 (状态码, 响应体, 额外响应头)"""
+        messages = body.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        with self._lock:
+            self.prompt_counts[prompt] += 1
+            roll = self.rng.random()
+            delay = self.latency(self.rng)
+        time.sleep(max(delay, 0))
+
+        if roll < self.rate_limit_rate:
+            return 429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}}, {"Retry-After": "0"}
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, {"error": {"message": "Internal server error", "type": "server_error"}}, {}
+
+        content = self._content(prompt)
+        if roll < self.rate_limit_rate + self.error_rate + self.malformed_rate:
+            # 截断 JSON 模拟模型输出不完整
+            content = content[:max(len(content) // 2, 1)]
+            with self._lock:
+                self.malformed += 1
+        completion_tokens = len(content) // 4 + 1
+        with self._lock:
+            self.completion_tokens += completion_tokens
+        return 200, {
+            "id": f"chatcmpl-mock-{self.rng.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4 + 1,
+                "completion_tokens": completion_tokens,
+                "total_tokens": (len(prompt) + len(content)) // 4 + 2,
+            },
+        }, {}
+
+    def _content(self, prompt):
+        m = _PROMPT_RE.search(prompt)
+        if not m:
+            return json.dumps({"pattern": ".+", "fields": [], "priority": 1, "examples": []})
+        log_text = m.group("log").strip()
+        if log_text in self.recordings:
+            with self._lock:
+                self.replayed += 1
+            return self.recordings[log_text]
+        try:
+            log_fields = json.loads(m.group("fields").strip())
+        except json.JSONDecodeError:
+            log_fields = []
+        rule = self.synthesizer.synthesize(log_text, log_fields) if log_fields else None
+        if rule is None:
+            rule = {"pattern": re.escape(log_text), "fields": [], "priority": 1, "examples": [log_text]}
+        return json.dumps(rule, ensure_ascii=False)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"未知路径：{self.path}"}}, {})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self._send(400, {"error": {"message": "请求体不是合法的 JSON"}}, {})
+                    return
+                status, payload, headers = server._respond(body)
+                with server._lock:
+                    server.status_counts[status] += 1
+                self._send(status, payload, headers)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/stats":
+                    self._send(200, server.stats(), {})
+                else:
+                    self._send(404, {"error": {"message": f"未知路径：{self.path}"}}, {})
+
+            def _send(self, status, payload, headers):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="fixed:0", help="延迟分布，如 fixed:0.2、uniform:0.1,0.5、exp:0.3、lognormal:-1.5,0.5")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="返回 500 错误的比例")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--malformed_rate", type=float, default=0.0, help="返回不完整 JSON 的比例")
+    parser.add_argument("--record_file", default=None, help="录制的响应（JSON Lines），命中时直接回放")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    recordings = load_recordings(args.record_file) if args.record_file else None
+    server = MockLLMServer(args.host, args.port, args.latency, args.error_rate, args.rate_limit_rate,
+                           args.malformed_rate, recordings, args.seed)
+    print(f"模拟大模型服务已启动：{server.url}（OpenAI 接口为 {server.url}/v1）")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
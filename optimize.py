@@ -0,0 +1,276 @@
+import json
+import re
+import argparse
+from collections import Counter
+
+from extract import clean_log_text
+
+
+_SPECIAL = set(".^$*+?{}[]()|\\")
+_QUANTIFIERS = set("*+?{")
+
+
+def _skip_class(pattern, i):
+    """i 指向 '['，返回字符类结束后的位置"""
+    j = i + 1
+    if j < len(pattern) and pattern[j] == "^":
+        j += 1
+    if j < len(pattern) and pattern[j] == "]":
+        j += 1
+    while j < len(pattern) and pattern[j] != "]":
+        j += 2 if pattern[j] == "\\" else 1
+    return j + 1
+
+
+def _skip_group(pattern, i):
+    """i 指向 '('，返回与之配对的 ')' 之后的位置"""
+    depth = 0
+    j = i
+    while j < len(pattern):
+        c = pattern[j]
+        if c == "\\":
+            j += 2
+            continue
+        if c == "[":
+            j = _skip_class(pattern, j)
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return j + 1
+        j += 1
+    return j
+
+
+def tokenize(pattern):
+    """将正则切分为顶层记号：转义、字符类、整组、单字符（量词单独成记号）"""
+    tokens = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            end = i + 2
+        elif c == "[":
+            end = _skip_class(pattern, i)
+        elif c == "(":
+            end = _skip_group(pattern, i)
+        elif c == "{" and re.match(r"\{\d*,?\d*\}", pattern[i:]):
+            end = i + re.match(r"\{\d*,?\d*\}", pattern[i:]).end()
+        else:
+            end = i + 1
+        # 量词后的 ? / + 属于同一个量词
+        if c in _QUANTIFIERS and end < len(pattern) and pattern[end] in "?+":
+            end += 1
+        tokens.append(pattern[i:end])
+        i = end
+    return tokens
+
+
+def is_quantifier(token):
+    return token[0] in _QUANTIFIERS
+
+
+def literal_char(token):
+    """若记号是单个字面字符则返回该字符，否则返回 None"""
+    if len(token) == 1 and token not in _SPECIAL:
+        return token
+    if len(token) == 2 and token[0] == "\\" and not token[1].isalnum():
+        return token[1]
+    return None
+
+
+def is_atom(token):
+    """单个可直接接量词的原子：字面字符、转义、字符类或 '.'"""
+    return literal_char(token) is not None or token == "." or token[0] == "[" or (
+        token[0] == "\\" and len(token) == 2)
+
+
+def split_alternation(inner):
+    """按顶层 '|' 切分，返回各分支的记号列表"""
+    branches = [[]]
+    for token in tokenize(inner):
+        if token == "|":
+            branches.append([])
+        else:
+            branches[-1].append(token)
+    return branches
+
+
+def _group_prefix(group):
+    """返回组的开头部分及类型：capture / noncap / named / other"""
+    if group.startswith("(?P<"):
+        return group[:group.index(">") + 1], "named"
+    if group.startswith("(?:"):
+        return "(?:", "noncap"
+    if group.startswith("(?"):
+        return None, "other"
+    return "(", "capture"
+
+
+def _candidates(pattern):
+    """生成单步改写的候选：(改写类型, 新正则)。
+
+    不做行首锚定：示例已去掉优先级前缀和首尾空白，而提取阶段看到的是带头部的原始日志，锚定无法在示例上校验。
+    """
+    yield from _rewrite_tokens(pattern, "")
+
+
+def _stop_literal(tokens, i):
+    """tokens[i] 为字面字符且后面没有量词时返回该字符；X?、X* 等可以不出现，不能作为停止字符"""
+    if i >= len(tokens) or (i + 1 < len(tokens) and is_quantifier(tokens[i + 1])):
+        return None
+    return literal_char(tokens[i])
+
+
+def _rewrite_tokens(pattern, context):
+    """在记号序列上查找可改写的位置；嵌套组内部递归处理"""
+    tokens = tokenize(pattern)
+    for idx, token in enumerate(tokens):
+        following = tokens[idx + 1] if idx + 1 < len(tokens) else ""
+        before = "".join(tokens[:idx])
+        after = "".join(tokens[idx + 1:])
+
+        # .*? / .+? 后紧跟字面字符 X 时改写为 [^X\n]* / [^X\n]+
+        if token == "." and following in ("*?", "+?"):
+            stop = _stop_literal(tokens, idx + 2)
+            if stop is None:
+                stop = _first_literal_after(after[len(following):], context)
+            if stop is not None:
+                escaped = "\\" + stop if stop in "\\]^-[" else stop
+                cls = f"[^{escaped}\\n]{following[0]}"
+                yield "lazy_dot", before + cls + "".join(tokens[idx + 2:])
+
+        if token[0] != "(" or len(token) < 2:
+            continue
+        prefix, kind = _group_prefix(token)
+        if kind == "other":
+            continue
+        inner = token[len(prefix):-1]
+        quantified = bool(following) and is_quantifier(following)
+        branches = split_alternation(inner)
+
+        if kind in ("capture", "noncap"):
+            inner_tokens = tokenize(inner)
+            if len(inner_tokens) == 1 and is_atom(inner_tokens[0]):
+                yield "useless_group", before + inner + after
+            elif not quantified and len(branches) == 1:
+                yield "useless_group", before + inner + after
+            elif kind == "capture":
+                yield "useless_group", before + "(?:" + inner + ")" + after
+
+        # 纯字面分支的公共前缀提取
+        if len(branches) > 1 and all(all(literal_char(t) is not None for t in b) for b in branches):
+            common = 0
+            shortest = min(len(b) for b in branches)
+            while common < shortest and len({b[common] for b in branches}) == 1:
+                common += 1
+            if common:
+                rests = "|".join("".join(b[common:]) for b in branches)
+                factored = "".join(branches[0][:common]) + "(?:" + rests + ")"
+                yield "common_prefix", before + prefix + factored + ")" + after
+
+        # 递归处理组内部，返回时把组重新拼回去
+        rest_context = after + context
+        for kind_name, new_inner in _rewrite_tokens(inner, ")" + rest_context):
+            yield kind_name, before + prefix + new_inner + ")" + after
+
+
+def _first_literal_after(text, context):
+    """跳过组的右括号后取第一个字面字符（用于 (?P<x>.*?)X 的情况）"""
+    remaining = text + context
+    while remaining.startswith(")"):
+        remaining = remaining[1:]
+        if remaining and remaining[0] in _QUANTIFIERS:
+            return None
+    return _stop_literal(tokenize(remaining[:4]), 0)
+
+
+def _signature(compiled, examples):
+    results = []
+    for example in examples:
+        m = compiled.search(example)
+        results.append(m.groupdict() if m else None)
+    return results
+
+
+def _fallback_signature(pattern, fallback_examples):
+    """相似度回退阶段的结果：正则中的 \\- 替换为 _，在额外清洗后的示例上匹配"""
+    try:
+        compiled = re.compile(re.sub(r"\\-", "_", pattern))
+    except re.error:
+        return None
+    return _signature(compiled, fallback_examples)
+
+
+def optimize_pattern(pattern, examples, max_rounds=100):
+    """对单条正则反复应用改写，每一步都必须在全部示例上得到相同的命名捕获组结果；返回 (新正则, 改写计数)"""
+    applied = Counter()
+    if not examples:
+        return pattern, applied
+    try:
+        baseline = _signature(re.compile(pattern), examples)
+    except re.error:
+        return pattern, applied
+    # 改写还需保持回退阶段的结果不变
+    fallback_examples = [clean_log_text(e, use_extra_clean=True) for e in examples]
+    fallback_baseline = _fallback_signature(pattern, fallback_examples)
+
+    # 存在数字反向引用时去掉分组会改变组号，不做分组相关改写
+    has_backref = re.search(r"\\[1-9]", pattern) is not None
+    rejected = set()
+    for _ in range(max_rounds):
+        for kind, candidate in _candidates(pattern):
+            if candidate == pattern or candidate in rejected:
+                continue
+            if has_backref and kind == "useless_group":
+                continue
+            try:
+                compiled = re.compile(candidate)
+            except re.error:
+                rejected.add(candidate)
+                continue
+            if (_signature(compiled, examples) != baseline
+                    or _fallback_signature(candidate, fallback_examples) != fallback_baseline):
+                rejected.add(candidate)
+                continue
+            pattern = candidate
+            applied[kind] += 1
+            break
+        else:
+            break
+    return pattern, applied
+
+
+def optimize_rules(rules):
+    """优化规则列表中的正则，返回 (规则列表, 统计信息)"""
+    stats = Counter()
+    for rule in rules:
+        pattern = rule.get("pattern", "")
+        new_pattern, applied = optimize_pattern(pattern, rule.get("examples", []))
+        if new_pattern != pattern:
+            rule["pattern"] = new_pattern
+            stats["rules_rewritten"] += 1
+            stats.update(applied)
+    return rules, stats
+
+
+def optimize(rules_file, output_file=None):
+    """优化已有规则文件，默认原地覆盖"""
+    with open(rules_file, encoding="utf-8") as f:
+        rules = json.load(f)
+    rules, stats = optimize_rules(rules)
+    with open(output_file or rules_file, "w", encoding="utf-8") as f:
+        json.dump(rules, f, indent=2, ensure_ascii=False)
+    print(f"共 {len(rules)} 条规则，改写 {stats['rules_rewritten']} 条："
+          + "，".join(f"{k} {v}" for k, v in stats.items() if k != "rules_rewritten"))
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules_file", required=True, help="待优化的规则文件")
+    parser.add_argument("--output_file", default=None, help="输出路径，默认覆盖原文件")
+    args = parser.parse_args()
+    optimize(args.rules_file, args.output_file)
@@ -0,0 +1,269 @@
+import json
+import re
+from collections import Counter
+from heapq import merge
+
+
+# 默认的路由键提取规则：只作用于日志头部，取命名组 key（没有时取整个匹配）
+DEFAULT_KEY_EXTRACTORS = [
+    # 华为等设备的 %%01SHELL/5/CMDRECORD 模块标识
+    r"%%\d*(?P<key>[A-Za-z][\w-]*/\d+/[\w-]+)",
+    # 思科的 %ASA-6-302013 标识
+    r"%(?P<key>[A-Z][\w-]*-\d+-[\w-]+):",
+    # CEF 格式的 Vendor|Product
+    r"CEF:\d+\|(?P<key>[^|]*\|[^|]*)\|",
+    # 标准 syslog 头部中的程序名
+    r"^(?:<\d+>)?[A-Z][a-z]{2} +\d{1,2}(?: \d{4})? \d{2}:\d{2}:\d{2} \S+ (?P<key>[A-Za-z][\w./-]*)(?:\[\d+\])?:",
+]
+
+
+# 会改变整条正则匹配方式的内联标志，出现时不做字面文本预筛
+_INLINE_FLAGS = set("aiLmsux")
+_BRACE_QUANTIFIER = re.compile(r"\{\d*,?\d*\}")
+
+
+def required_literal(pattern):
+    """正则顶层连续字面文本中最长的一段，能被该正则匹配的文本必然包含它；顶层有分支或内联标志时返回空串"""
+    runs = [[]]
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            nxt = pattern[i + 1:i + 2]
+            if nxt.isdigit() or nxt in ("x", "u", "U", "N"):
+                # 反向引用和字符编码转义，不做预筛
+                return ""
+            if not depth:
+                if nxt and not nxt.isalnum():
+                    runs[-1].append(nxt)
+                else:
+                    runs.append([])
+            i += 2
+            continue
+        if c == "[":
+            # 跳过字符类，[]a] 与 [^]a] 中开头的 ] 属于字符类本身
+            if not depth:
+                runs.append([])
+            i += 2 if pattern[i + 1:i + 2] == "^" else 1
+            i += 1 if pattern[i:i + 1] == "]" else 0
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+            i += 1
+            continue
+        if c == "(":
+            if pattern[i + 1:i + 2] == "?" and pattern[i + 2:i + 3] in _INLINE_FLAGS:
+                return ""
+            if not depth:
+                runs.append([])
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif depth:
+            pass
+        elif c == "|":
+            return ""
+        elif c in "*?" or (c == "{" and _BRACE_QUANTIFIER.match(pattern, i)):
+            # 量词作用的字符可能不出现
+            if runs[-1]:
+                runs[-1].pop()
+            runs.append([])
+            if c == "{":
+                i = _BRACE_QUANTIFIER.match(pattern, i).end()
+                continue
+        elif c in "+.^$":
+            runs.append([])
+        else:
+            runs[-1].append(c)
+        i += 1
+    return max(("".join(run) for run in runs), key=len)
+
+
+def load_key_extractors(config_file):
+    """从 JSON 文件读取路由键提取正则列表"""
+    with open(config_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class RuleRouter:
+    """按日志头部的路由键把规则分片，解析时只尝试对应分片中的规则"""
+
+    def __init__(self, rules, extractors=None, learn=True, header_size=256, cross_check=True, key_examples=16):
+        self.header_size = header_size
+        self.extractors = [re.compile(p) for p in (extractors or DEFAULT_KEY_EXTRACTORS)]
+        if learn:
+            self._learn_extractors(rules)
+        # cross_check: 分片之外能匹配该分片示例的规则也加入分片，在路由键首次被使用时检查；
+        # 每个路由键最多保留 key_examples 条示例用于检查
+        self.cross_check = cross_check
+        self.key_examples = key_examples
+        self.examples = {}
+        self.rules = list(rules)
+        self._positions = {id(rule): i for i, rule in enumerate(self.rules)}
+        self._checked = set()
+        # 按规则必需字面文本中最少见的 3 字符片段建立的索引，首次检查时才构建
+        self._literals = None
+        self._literal_index = None
+        self._gram_counts = None
+        self._unindexed = None
+        self.routed = 0
+        self.unknown = 0
+        self.shard_misses = 0
+        self.cross_added = 0
+        self._build_shards(rules)
+
+    def key(self, log_text):
+        header = log_text[:self.header_size]
+        for i, extractor in enumerate(self.extractors):
+            m = extractor.search(header)
+            if m:
+                value = m.group("key") if "key" in extractor.groupindex else m.group(0)
+                return f"{i}:{value}"
+        return None
+
+    def _learn_extractors(self, rules):
+        """按在规则示例上的命中次数对提取规则排序，去掉从未命中的提取规则"""
+        hits = [0] * len(self.extractors)
+        for rule in rules:
+            for example in rule.get("examples", []):
+                header = example[:self.header_size]
+                for i, extractor in enumerate(self.extractors):
+                    if extractor.search(header):
+                        hits[i] += 1
+                        break
+        if any(hits):
+            order = sorted((i for i in range(len(self.extractors)) if hits[i]), key=lambda i: -hits[i])
+            self.extractors = [self.extractors[i] for i in order]
+
+    def _build_shards(self, rules):
+        """规则按其示例的路由键进入对应分片；示例中取不到键的规则放入每个分片。分片内保持原有规则顺序"""
+        keyed = {}
+        keyless = []
+        for index, rule in enumerate(rules):
+            keys = self._rule_keys(rule)
+            if not keys:
+                keyless.append(index)
+            for key in keys:
+                keyed.setdefault(key, []).append(index)
+        self.keyless = [rules[i] for i in keyless]
+        self.shards = {key: [rules[i] for i in merge(indices, keyless)] for key, indices in keyed.items()}
+
+    def _rule_keys(self, rule):
+        keys = set()
+        for example in rule.get("examples", []):
+            key = self.key(example)
+            if key is None:
+                continue
+            keys.add(key)
+            examples = self.examples.setdefault(key, [])
+            if len(examples) < self.key_examples:
+                examples.append(example)
+        return keys
+
+    @staticmethod
+    def _priority(rule):
+        return rule.get("priority", 0)
+
+    @staticmethod
+    def _grams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def _index_literals(self):
+        literals = [required_literal(rule.get("pattern", "")) for rule in self.rules]
+        self._gram_counts = Counter(gram for literal in literals for gram in self._grams(literal))
+        self._literals = []
+        self._literal_index = {}
+        self._unindexed = []
+        for literal in literals:
+            self._index_literal(literal)
+
+    def _index_literal(self, literal):
+        """以字面文本中在全部规则里最少见的 3 字符片段为索引键，使每个片段下的候选规则尽量少"""
+        position = len(self._literals)
+        self._literals.append(literal)
+        grams = self._grams(literal)
+        if grams:
+            gram = min(grams, key=lambda g: (self._gram_counts[g], g))
+            self._literal_index.setdefault(gram, []).append(position)
+        else:
+            self._unindexed.append(position)
+
+    def _matches_examples(self, position, key):
+        """规则能否匹配该路由键的某条示例，先用必需字面文本预筛"""
+        examples = self.examples.get(key, ())
+        literal = self._literals[position]
+        if not any(literal in e for e in examples):
+            return False
+        compiled = self.rules[position].get("compiled")
+        return compiled is not None and any(compiled.search(e) for e in examples)
+
+    def _cross_check(self, key):
+        """把不在分片内、但能匹配该路由键示例的规则按原有顺序加入分片。
+
+        只检查索引片段出现在示例中的规则；优先级低于分片内最低优先级的规则不可能被选中，不做检查。
+        """
+        self._checked.add(key)
+        shard = self.shards[key]
+        if not shard:
+            return
+        if self._literals is None:
+            self._index_literals()
+        members = {id(rule) for rule in shard}
+        floor = min(self._priority(rule) for rule in shard)
+        candidates = set(self._unindexed)
+        for gram in set().union(*map(self._grams, self.examples.get(key, ()))):
+            candidates.update(self._literal_index.get(gram, ()))
+        extra = [self.rules[i] for i in sorted(candidates)
+                 if id(self.rules[i]) not in members and self._priority(self.rules[i]) >= floor
+                 and self._matches_examples(i, key)]
+        if extra:
+            self.cross_added += len(extra)
+            shard[:] = sorted(shard + extra, key=lambda rule: self._positions[id(rule)])
+
+    def add_rule(self, rule):
+        """增量加入一条规则，追加在相应分片末尾"""
+        self._positions[id(rule)] = len(self.rules)
+        self.rules.append(rule)
+        if self._literals is not None:
+            literal = required_literal(rule.get("pattern", ""))
+            self._gram_counts.update(self._grams(literal))
+            self._index_literal(literal)
+        keys = self._rule_keys(rule)
+        if not keys:
+            self.keyless.append(rule)
+            for shard in self.shards.values():
+                shard.append(rule)
+        for key in keys:
+            if key not in self.shards:
+                # 新的路由键，已有规则的交叉检查在首次使用时进行
+                self.shards[key] = list(self.keyless)
+            self.shards[key].append(rule)
+        if self.cross_check and keys and self._literals is not None:
+            # 新规则能匹配已检查分片的示例时也加入这些分片，未检查的分片在首次使用时会检查到它
+            position = len(self.rules) - 1
+            for key in self._checked:
+                if key not in keys and self._matches_examples(position, key):
+                    self.shards[key].append(rule)
+                    self.cross_added += 1
+
+    def route(self, log_text):
+        """返回该日志应尝试的规则分片，路由键未知时返回 None（由调用方使用全部规则）"""
+        key = self.key(log_text)
+        shard = self.shards.get(key)
+        if shard is None:
+            self.unknown += 1
+            return None
+        if self.cross_check and key not in self._checked:
+            self._cross_check(key)
+        self.routed += 1
+        return shard
+
+    def report(self):
+        return {
+            "routed": self.routed,
+            "unknown": self.unknown,
+            "shard_misses": self.shard_misses,
+            "cross_added": self.cross_added,
+            "shards": len(self.shards),
+            "keyless_rules": len(self.keyless),
+        }
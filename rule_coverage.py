@@ -0,0 +1,65 @@
+from extract import LogParser
+from synthesize import preprocess_log
+
+
+# LogParser 编译时写入规则的运行期字段，保存规则文件前需要去除
+RUNTIME_KEYS = ("compiled", "field_names")
+
+
+class RuleCoverage:
+    """维护已接受规则上的 LogParser，调用大模型前先判断日志是否已被现有规则正确覆盖"""
+
+    def __init__(self, seed_rules_file=None):
+        self.parser = LogParser(seed_rules_file)
+        # 按 pattern 去重的规则字典，与 generate 中的 rules_dict 含义一致
+        self.rules_dict = {}
+        for rule in self.parser.rules:
+            pattern = rule.get("pattern", "").strip()
+            if pattern and pattern not in self.rules_dict:
+                self.rules_dict[pattern] = rule
+        self.covered_count = 0
+        # 每条规则 examples 对应的集合，避免逐条补充示例时线性查重
+        self._example_sets = {}
+
+    def _example_set(self, rule):
+        examples = self._example_sets.get(id(rule))
+        if examples is None:
+            examples = self._example_sets[id(rule)] = set(rule.setdefault("examples", []))
+        return examples
+
+    def covering_rule(self, log_text, log_fields):
+        """若提取阶段会选中的规则恰好提取出全部标注字段，返回该规则，否则返回 None"""
+        rule, m = self.parser.match(log_text)
+        if not rule:
+            return None
+        extracted = {k: (v.strip() if v else "") for k, v in m.groupdict().items()}
+        expected = {f.get("name"): (f.get("value") or "").strip() for f in log_fields}
+        return rule if extracted == expected else None
+
+    def add_example(self, rule, log_text):
+        """被覆盖的日志只补充到规则的 examples 中"""
+        example = preprocess_log(log_text)
+        seen = self._example_set(rule)
+        if example not in seen:
+            seen.add(example)
+            rule["examples"].append(example)
+        self.covered_count += 1
+
+    def accept(self, rule):
+        """接受一条新生成的规则：相同 pattern 合并示例，否则加入解析器"""
+        pattern = rule.get("pattern", "").strip()
+        if pattern in self.rules_dict:
+            existing = self.rules_dict[pattern]
+            seen = self._example_set(existing)
+            for ex in rule.get("examples", []):
+                if ex not in seen:
+                    seen.add(ex)
+                    existing["examples"].append(ex)
+            return existing
+        self.rules_dict[pattern] = rule
+        self.parser.add_rule(rule)
+        return rule
+
+    def export(self):
+        """返回可直接保存为 JSON 的规则列表"""
+        return [{k: v for k, v in rule.items() if k not in RUNTIME_KEYS} for rule in self.rules_dict.values()]
@@ -0,0 +1,151 @@
+import re
+import sys
+from array import array
+
+
+_MISSING = object()
+
+
+class RuleRecord:
+    """紧凑的规则记录。支持 rule["pattern"] / rule.get("priority", 0) 等字典式访问，兼容原有按字典使用规则的代码"""
+
+    __slots__ = ("store", "index", "pattern", "field_names", "_compiled")
+
+    def __init__(self, store, index, pattern):
+        self.store = store
+        self.index = index
+        self.pattern = pattern
+        self.field_names = None
+        self._compiled = _MISSING
+
+    @property
+    def compiled(self):
+        """首次使用时才编译，编译失败记为 None"""
+        if self._compiled is _MISSING:
+            self._compiled = self.store.compile(self)
+        return self._compiled
+
+    def get(self, key, default=None):
+        if key == "pattern":
+            return self.pattern
+        if key == "compiled":
+            compiled = self.compiled
+            return default if compiled is None else compiled
+        if key == "field_names":
+            return default if self.compiled is None else self.field_names
+        if key == "priority":
+            return self.store.priority_of(self.index, default)
+        if key == "examples":
+            return self.store.examples_of(self.index)
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+
+class RuleStore:
+    """数组化的规则存储：优先级和示例索引放在 array 中，示例文本去重到共享字符串表，字段名元组驻留复用"""
+
+    def __init__(self, rules=()):
+        self.records = []
+        self.strings = []
+        self._string_ids = {}
+        self._field_tuples = {}
+        self.compiled_count = 0
+        # 缺少 priority 的规则记为 NaN
+        self.priorities = array("d")
+        self.example_offsets = array("I", [0])
+        self.example_ids = array("I")
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+        index = len(self.records)
+        priority = rule.get("priority")
+        try:
+            self.priorities.append(float("nan") if priority is None else priority)
+        except TypeError:
+            # 出现非数值的 priority 时退回普通列表
+            self.priorities = list(self.priorities)
+            self.priorities.append(priority)
+        for example in rule.get("examples", []):
+            self.example_ids.append(self._intern(example))
+        self.example_offsets.append(len(self.example_ids))
+        record = RuleRecord(self, index, rule["pattern"])
+        self.records.append(record)
+        return record
+
+    def _intern(self, text):
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            self._string_ids[text] = string_id
+            self.strings.append(text)
+        return string_id
+
+    def compile(self, record):
+        try:
+            compiled = re.compile(record.pattern)
+        except re.error as e:
+            print(f"规则编译失败：{record.pattern} - {str(e)}")
+            return None
+        names = tuple(compiled.groupindex)
+        record.field_names = self._field_tuples.setdefault(names, names)
+        self.compiled_count += 1
+        return compiled
+
+    def priority_of(self, index, default=None):
+        priority = self.priorities[index]
+        if not isinstance(priority, float):
+            return priority
+        if priority != priority:
+            return default
+        return int(priority) if priority.is_integer() else priority
+
+    def examples_of(self, index):
+        start, end = self.example_offsets[index], self.example_offsets[index + 1]
+        return [self.strings[i] for i in self.example_ids[start:end]]
+
+    def memory_report(self):
+        """各部分占用内存的估算（字节），不含 re 模块自身的编译缓存"""
+        def array_bytes(a):
+            return a.buffer_info()[1] * a.itemsize
+
+        records = sum(sys.getsizeof(r) for r in self.records) + sys.getsizeof(self.records)
+        patterns = sum(sys.getsizeof(r.pattern) for r in self.records)
+        examples = sum(sys.getsizeof(s) for s in self.strings) + sys.getsizeof(self.strings)
+        # 示例去重用的字典（键与 strings 共享，只计字典本身和较大的整数编号）
+        string_index = sys.getsizeof(self._string_ids) + sum(sys.getsizeof(i) for i in range(257, len(self.strings)))
+        # 已编译正则（含编译后的字节码）及其分组名字典，以及驻留的字段名元组
+        compiled = 0
+        for record in self.records:
+            if record._compiled is not _MISSING and record._compiled is not None:
+                compiled += sys.getsizeof(record._compiled) + sys.getsizeof(dict(record._compiled.groupindex))
+        field_names = sys.getsizeof(self._field_tuples) + sum(sys.getsizeof(t) for t in self._field_tuples)
+        arrays = array_bytes(self.example_offsets) + array_bytes(self.example_ids)
+        if isinstance(self.priorities, array):
+            arrays += array_bytes(self.priorities)
+        else:
+            arrays += sys.getsizeof(self.priorities)
+        total = records + patterns + examples + string_index + compiled + field_names + arrays
+        return {
+            "rules": len(self.records),
+            "compiled_rules": self.compiled_count,
+            "unique_examples": len(self.strings),
+            "example_refs": len(self.example_ids),
+            "field_name_tuples": len(self._field_tuples),
+            "record_bytes": records,
+            "pattern_bytes": patterns,
+            "example_bytes": examples,
+            "string_index_bytes": string_index,
+            "compiled_bytes": compiled,
+            "field_name_bytes": field_names,
+            "array_bytes": arrays,
+            "total_bytes": total,
+        }
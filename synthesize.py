@@ -0,0 +1,245 @@
+import json
+import re
+import argparse
+
+
+# 字段值类型推断表：按顺序尝试，取第一个能完整匹配字段值的类型
+VALUE_CLASSES = [
+    ("timestamp", r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"),
+    ("timestamp", r"\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}(?:[.,]\d+)?"),
+    ("timestamp", r"[A-Z][a-z]{2} +\d{1,2}(?: \d{4})? \d{2}:\d{2}:\d{2}(?: \d{4})?"),
+    ("timestamp", r"\d{4} [A-Z][a-z]{2} +\d{1,2} \d{2}:\d{2}:\d{2}"),
+    ("timestamp", r"\d{2}:\d{2}:\d{2}(?:[.,]\d+)?"),
+    ("mac", r"[0-9A-Fa-f]{2}(?:[:-][0-9A-Fa-f]{2}){5}|[0-9A-Fa-f]{4}(?:[.-][0-9A-Fa-f]{4}){2}"),
+    ("ip", r"\d{1,3}(?:\.\d{1,3}){3}"),
+    ("digits", r"\d+"),
+    ("word", r"\w+"),
+]
+
+_FIELD_NAME = re.compile(r"[A-Za-z_]\w*")
+
+# 字面文本中未标注的时间戳（包括不带时间的“月 日”），合成时泛化为对应格式，避免月份、日期写死在规则中
+_MONTH_DAY = r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +\d{1,2}\b"
+_TIMESTAMP_REGEXES = [regex for value_type, regex in VALUE_CLASSES if value_type == "timestamp"]
+_TIMESTAMP_TEXT = re.compile("|".join(f"(?:{regex})" for regex in _TIMESTAMP_REGEXES + [_MONTH_DAY]))
+# 日志开头的时间戳之后的主机名
+_HEADER_HOST = re.compile(r"(\s+)(\S+)(?=\s)")
+
+
+def preprocess_log(log_text):
+    """与 RuleGenerator.analyze_log 一致的预处理：移除优先级字段并去除首尾空白"""
+    return re.sub(r'<\d+>', '', log_text).strip()
+
+
+def infer_value_class(value, next_literal):
+    """推断字段值的类型及对应的正则，next_literal 为紧随字段之后的字面文本"""
+    for value_type, regex in VALUE_CLASSES:
+        if re.fullmatch(regex, value):
+            return value_type, regex
+    has_space = re.search(r"\s", value) is not None
+    if not next_literal:
+        # 位于日志末尾的字段，贪婪匹配到行尾
+        return ("text", r".+") if has_space else ("token", r"\S+")
+    stop = next_literal[0]
+    if stop.isspace():
+        return ("text", r".+?") if has_space else ("token", r"\S+")
+    if stop in value:
+        return ("text", r".+?") if has_space else ("token", r"\S+?")
+    if has_space:
+        return "text", rf"[^{re.escape(stop)}]+"
+    return "token", rf"[^\s{re.escape(stop)}]+"
+
+
+def _timestamp_regex(text):
+    for regex in _TIMESTAMP_REGEXES:
+        if re.fullmatch(regex, text):
+            return regex
+    return r"[A-Z][a-z]{2} +\d{1,2}"
+
+
+def split_literal(literal, header=False):
+    """将字面文本切分为 (文本, 泛化正则) 片段，正则为 None 的片段按字面处理。
+    未标注的时间戳泛化为对应格式；header 为日志开头的文本时，开头时间戳之后的主机名泛化为 \\S+"""
+    cursor = 0
+    for m in _TIMESTAMP_TEXT.finditer(literal):
+        if m.start() > cursor:
+            yield literal[cursor:m.start()], None
+        yield m.group(), _timestamp_regex(m.group())
+        cursor = m.end()
+        if header and m.start() == 0:
+            host = _HEADER_HOST.match(literal, cursor)
+            if host:
+                yield host.group(1), None
+                yield host.group(2), r"\S+"
+                cursor = host.end()
+    if cursor < len(literal):
+        yield literal[cursor:], None
+
+
+def literal_to_regex(literal, generalize=True, header=False):
+    """将字段之间的字面文本转义为正则，时间戳和头部主机名按 split_literal 泛化，generalize 时再将空白和数字泛化"""
+    return "".join(regex if regex is not None else _escape_literal(text, generalize)
+                   for text, regex in split_literal(literal, header))
+
+
+def _escape_literal(literal, generalize):
+    if not generalize:
+        return re.escape(literal)
+    parts = []
+    for piece in re.split(r"(\s+|\d+)", literal):
+        if not piece:
+            continue
+        if piece.isspace():
+            parts.append(r"\s+")
+        elif piece.isdigit():
+            parts.append(r"\d+")
+        else:
+            parts.append(re.escape(piece))
+    return "".join(parts)
+
+
+class RuleSynthesizer:
+    """不调用大模型，直接根据标注字段在日志中的位置合成解析规则"""
+
+    def __init__(self, priority=1, max_assignments=16, min_anchor=2):
+        self.priority = priority
+        self.max_assignments = max_assignments
+        # 规则中至少需要的字面锚点字符数（非空白、非数字），否则几乎能匹配任何日志
+        self.min_anchor = min_anchor
+
+    def synthesize(self, log_text, log_fields):
+        """合成并校验规则，成功返回与大模型输出同结构的规则字典，否则返回 None"""
+        log_text = preprocess_log(log_text)
+        fields = [(f.get("name", ""), f.get("value", "")) for f in log_fields]
+        if not fields or not log_text:
+            return None
+        names = [name for name, _ in fields]
+        if len(set(names)) != len(names):
+            return None
+        for name, value in fields:
+            if not _FIELD_NAME.fullmatch(name) or not isinstance(value, str) or not value.strip():
+                return None
+
+        for spans in self._assign_spans(log_text, fields):
+            # 先尝试泛化的字面文本，失败时退回严格转义
+            for generalize in (True, False):
+                rule = self._build_rule(log_text, spans, generalize)
+                if rule and self.verify(rule, log_text, fields):
+                    return rule
+        return None
+
+    def _assign_spans(self, log_text, fields):
+        """为每个字段在日志中找到互不重叠、按位置递增的区间，优先选择在词边界上的出现位置"""
+        occurrences = {}
+        for name, value in fields:
+            starts = [m.start() for m in re.finditer(re.escape(value), log_text)]
+            if not starts:
+                return
+            aligned = [s for s in starts if self._on_boundary(log_text, s, s + len(value))]
+            occurrences[name] = aligned + [s for s in starts if s not in aligned]
+        ordered = sorted(fields, key=lambda f: occurrences[f[0]][0])
+
+        yielded = 0
+        stack = [(0, 0, [])]
+        while stack and yielded < self.max_assignments:
+            index, cursor, spans = stack.pop()
+            if index == len(ordered):
+                yielded += 1
+                yield spans
+                continue
+            name, value = ordered[index]
+            candidates = [s for s in occurrences[name] if s >= cursor]
+            # 逆序入栈，保证优先探索靠前的候选位置
+            for start in reversed(candidates):
+                stack.append((index + 1, start + len(value), spans + [(start, start + len(value), name, value)]))
+
+    @staticmethod
+    def _on_boundary(text, start, end):
+        before = text[start - 1] if start > 0 else ""
+        after = text[end] if end < len(text) else ""
+        return not (before.isalnum() or after.isalnum())
+
+    def _build_rule(self, log_text, spans, generalize):
+        """字段紧挨着（之间没有字面文本）或字面锚点不足时返回 None"""
+        parts = []
+        field_infos = []
+        cursor = 0
+        anchor = 0
+        for start, end, name, value in spans:
+            if cursor and start == cursor:
+                return None
+            anchor += self._anchor_chars(log_text[cursor:start], cursor == 0)
+            parts.append(literal_to_regex(log_text[cursor:start], generalize, cursor == 0))
+            value_type, regex = infer_value_class(value, log_text[end:])
+            parts.append(f"(?P<{name}>{regex})")
+            field_infos.append({"name": name, "type": value_type, "example": value})
+            cursor = end
+        anchor += self._anchor_chars(log_text[cursor:], False)
+        if anchor < self.min_anchor:
+            return None
+        parts.append(literal_to_regex(log_text[cursor:], generalize))
+        return {
+            "pattern": "".join(parts),
+            "fields": field_infos,
+            "priority": self.priority,
+            "examples": [log_text],
+        }
+
+    @staticmethod
+    def _anchor_chars(literal, header):
+        """字面文本中保留为字面的非空白、非数字字符数（泛化掉的时间戳和主机名不计）"""
+        return sum(len(re.sub(r"[\s\d]", "", text)) for text, regex in split_literal(literal, header) if regex is None)
+
+    @staticmethod
+    def verify(rule, log_text, fields):
+        """校验规则能从日志中提取出与标注完全一致的字段"""
+        try:
+            compiled = re.compile(rule["pattern"])
+        except re.error:
+            return False
+        m = compiled.search(log_text)
+        if not m:
+            return False
+        group_dict = m.groupdict()
+        if set(group_dict) != {name for name, _ in fields}:
+            return False
+        return all((group_dict[name] or "").strip() == value.strip() for name, value in fields)
+
+
+def synthesize(labeled_data_file, rules_file):
+    """仅使用本地合成生成规则，返回规则列表和无法处理的日志序号"""
+    synthesizer = RuleSynthesizer()
+
+    with open(labeled_data_file, encoding="utf-8") as f:
+        data = json.load(f)
+
+    rules_dict = {}
+    unhandled = []
+    for i, item in enumerate(data):
+        rule = synthesizer.synthesize(item['logText'], item['logField'])
+        if not rule:
+            unhandled.append(i)
+            continue
+        pattern = rule["pattern"]
+        if pattern in rules_dict:
+            existing_ex = rules_dict[pattern]["examples"]
+            for ex in rule["examples"]:
+                if ex not in existing_ex:
+                    existing_ex.append(ex)
+        else:
+            rules_dict[pattern] = rule
+
+    final_rules = list(rules_dict.values())
+    with open(rules_file, "w", encoding="utf-8") as f:
+        json.dump(final_rules, f, indent=2, ensure_ascii=False)
+
+    print(f"本地合成规则 {len(final_rules)} 条，{len(unhandled)} 条日志需要大模型处理")
+    return final_rules, unhandled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--labeled_data_file", required=True)
+    parser.add_argument("--rules_file", default="classified_rules.json")
+    args = parser.parse_args()
+    synthesize(args.labeled_data_file, args.rules_file)
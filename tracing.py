@@ -0,0 +1,36 @@
+import json
+import random
+
+
+# 追踪级别：INFO 记录每条日志的解析结果，DEBUG 额外记录逐条规则的尝试和相似度
+OFF, INFO, DEBUG = 0, 1, 2
+LEVELS = {"off": OFF, "info": INFO, "debug": DEBUG}
+
+
+class Tracer:
+    """按级别开关的解析追踪。关闭时调用方只做一次级别判断，不格式化任何内容"""
+
+    def __init__(self, level="off", sample_rate=1.0, trace_file=None):
+        self.level = LEVELS[level] if isinstance(level, str) else level
+        self.sample_rate = sample_rate
+        # 指定 trace_file 时以 JSON Lines 写入文件，否则输出到控制台
+        self._file = open(trace_file, "a", encoding="utf-8") if trace_file and self.level else None
+
+    def begin(self):
+        """返回当前这条日志的追踪级别，未开启或未被采样时返回 OFF"""
+        if not self.level:
+            return OFF
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return OFF
+        return self.level
+
+    def emit(self, event, **fields):
+        if self._file:
+            self._file.write(json.dumps({"event": event, **fields}, ensure_ascii=False) + "\n")
+        else:
+            print(f"[TRACE] {event} " + " ".join(f"{k}={v}" for k, v in fields.items()))
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None